@@ -1,7 +1,6 @@
 import asyncio
 import logging
 import os
-from typing import Dict
 
 from aiogram.types import BotCommand, ErrorEvent
 from aiogram_dialog import setup_dialogs
@@ -9,8 +8,21 @@ from aiogram import Bot, Dispatcher
 from dotenv import load_dotenv
 
 from modules.auth import auth_router
-from modules.code import code_router, dialog
-from modules.db import UserData
+from modules.breaker import breakers
+from modules.cache import cache_stats
+from modules.catalog import catalog
+from modules.client import client_pool
+from modules.code import code_router, dialog, condition_page_urls
+from modules import config
+from modules.db import UserStore, create_backend
+from modules.formatter import formatter
+from modules.login import login_pool, SessionKeeper
+from modules.outbound import kispython_scheduler
+from modules.parsing import parse_executor
+from modules.storage import create_fsm_storage
+from modules.verdict import verdict_scheduler
+from modules.warmer import ConditionWarmer
+from modules.webhook import run_webhook
 
 
 FMT = "%(name)s : %(funcName)s : %(lineno)d : %(asctime)s : %(levelname)s : %(message)s"
@@ -19,20 +31,39 @@ logging.basicConfig(format=FMT, datefmt=DATE_FMT, level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 load_dotenv("./.env")
-dp = Dispatcher()
+dp = Dispatcher(storage=create_fsm_storage())
 API_TOKEN = os.getenv("BOT_TOKEN")
 
 
 @dp.shutdown()
-async def on_shutdown(db: Dict[int, UserData]):
-    for value in db.values():
-        session = value.session
-        if session is not None and not session.closed:
-            await session.close()
+async def on_shutdown(db: UserStore):
+    logger.info(f"Очередь запросов к kispython: {kispython_scheduler.stats()}")
+    logger.info(f"Кэши: {cache_stats()}")
+    logger.info(f"Кэш пользователей: {db.stats()}")
+    logger.info(f"Предохранители: { {name: breaker.stats() for name, breaker in breakers.items()} }")
+    await warmer.close()
+    await catalog.close()
+    await login_pool.close()
+    await session_keeper.close()
+    await verdict_scheduler.close()
+    await formatter.close()
+    parse_executor.close()
+    await db.close()
+    await client_pool.close()
+
+
+db = UserStore(
+    create_backend(config.USER_STORE),
+    flush_interval=config.USER_STORE_FLUSH_INTERVAL,
+    max_entries=config.USER_CACHE_SIZE,
+    idle_timeout=config.USER_IDLE_TIMEOUT,
+)
+
+session_keeper = SessionKeeper(db, config.SESSION_KEEPALIVE_INTERVAL, config.SESSION_KEEPALIVE_WINDOW)
+
+warmer = ConditionWarmer(condition_page_urls, config.CONDITION_WARMER_CONCURRENCY,
+                         config.CONDITION_WARMER_INTERVAL)
 
-
-
-db = {}
 commands = [
     BotCommand(command="auth", description="Авторизоваться через ЛКС МИРЭА"),
     BotCommand(command="code", description="Начать решать задачи"),
@@ -42,11 +73,23 @@ commands = [
 
 
 async def main():
+    client_pool.start()
+    await db.start()
+    catalog.start()
+    verdict_scheduler.start()
+    login_pool.replenish()
+    if config.SESSION_KEEPALIVE:
+        session_keeper.start()
+    if config.CONDITION_WARMER:
+        warmer.start()
     bot = Bot(token=API_TOKEN)
     await bot.set_my_commands(commands=commands)
     dp.include_routers(auth_router, code_router, dialog)
     setup_dialogs(dp)
-    await dp.start_polling(bot, db=db)
+    if config.BOT_MODE == "webhook":
+        await run_webhook(dp, bot, db=db)
+    else:
+        await dp.start_polling(bot, db=db)
 
 
 @dp.error()
@@ -0,0 +1,181 @@
+import math
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Hashable, Iterator
+
+from cachetools import TTLCache
+
+from . import config
+
+
+@dataclass(slots=True)
+class TokenBucket:
+    """
+    Корзина токенов одного пользователя
+    """
+    tokens: float #: Доступные токены
+    updated: float #: Время последнего пополнения, time.monotonic()
+
+
+class RateLimiter:
+    """
+    Ограничение частоты действий пользователей корзинами токенов
+
+    У каждого пользователя до burst токенов, один токен восстанавливается
+    за interval секунд. Корзины неактивных пользователей удаляются:
+    через burst * interval секунд корзина и так была бы полной
+
+    :param burst: максимальное количество действий подряд
+    :type burst: int
+    :param interval: время восстановления одного действия, в секундах
+    :type interval: float
+    :param maxsize: максимальное количество хранимых корзин
+    :type maxsize: int
+    """
+    def __init__(self, burst: int, interval: float, maxsize: int):
+        self.admitted = 0 #: Кол-во разрешённых действий
+        self.rejected = 0 #: Кол-во отклонённых действий
+        self._burst = burst
+        self._interval = interval
+        self._buckets = TTLCache(maxsize=maxsize, ttl=max(burst * interval, 1))
+
+    def acquire(self, key: Hashable) -> float:
+        """
+        Забирает токен из корзины пользователя
+
+        :param key: id пользователя
+        :type key: Hashable
+        :return: 0, если действие разрешено, иначе время до появления токена, в секундах
+        :rtype: float
+        """
+        if self._burst <= 0:
+            return 0
+        now = time.monotonic()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = TokenBucket(self._burst, now)
+        else:
+            bucket.tokens = min(self._burst, bucket.tokens + (now - bucket.updated) / self._interval)
+            bucket.updated = now
+        # Повторная запись продлевает время жизни корзины
+        self._buckets[key] = bucket
+        if bucket.tokens >= 1:
+            bucket.tokens -= 1
+            self.admitted += 1
+            return 0
+        self.rejected += 1
+        return (1 - bucket.tokens) * self._interval
+
+    def refund(self, key: Hashable):
+        """
+        Возвращает токен, если действие всё же не было выполнено
+
+        :param key: id пользователя
+        :type key: Hashable
+        """
+        bucket = self._buckets.get(key)
+        if bucket is not None:
+            bucket.tokens = min(self._burst, bucket.tokens + 1)
+            self.admitted -= 1
+
+
+class GateBusy(Exception):
+    """
+    Место в UpstreamGate не получено, сервис перегружен
+    """
+    def __init__(self, gate: "UpstreamGate"):
+        super().__init__(gate.name)
+        self.gate = gate #: Перегруженный сервис
+
+
+class UpstreamGate:
+    """
+    Ограничение количества одновременных обращений к внешнему сервису
+
+    В отличие от семафора не ставит запросы в очередь: при заполнении
+    новые запросы сразу отклоняются
+
+    :param name: название сервиса для сообщений
+    :type name: str
+    :param limit: максимальное количество одновременных обращений, 0 - без ограничения
+    :type limit: int
+    """
+    def __init__(self, name: str, limit: int):
+        self.name = name
+        self.rejected = 0 #: Кол-во отклонённых обращений
+        self._limit = limit
+        self._active = 0
+
+    @property
+    def active(self) -> int:
+        """
+        Количество обращений, выполняющихся в данный момент
+        """
+        return self._active
+
+    def try_acquire(self) -> bool:
+        """
+        Занимает место, если оно есть
+
+        :return: удалось ли занять место
+        :rtype: bool
+        """
+        if self._limit and self._active >= self._limit:
+            self.rejected += 1
+            return False
+        self._active += 1
+        return True
+
+    def release(self):
+        self._active -= 1
+
+    @contextmanager
+    def hold(self) -> Iterator[None]:
+        """
+        Контекстный менеджер, занимающий место на время обращений к сервису
+
+        :raises GateBusy: свободных мест нет
+        """
+        if not self.try_acquire():
+            raise GateBusy(self)
+        try:
+            yield
+        finally:
+            self.release()
+
+
+def wait_text(seconds: float) -> str:
+    """
+    Возвращает ответ пользователю на отклонённое действие
+
+    :param seconds: время до следующей попытки, в секундах
+    :type seconds: float
+    :return: текст ответа
+    :rtype: str
+    """
+    return f"Слишком много запросов, попробуйте через {max(1, math.ceil(seconds))} с"
+
+
+def busy_text(gate: UpstreamGate) -> str:
+    """
+    Возвращает ответ пользователю, если сервис перегружен
+
+    :param gate: перегруженный сервис
+    :type gate: UpstreamGate
+    :return: текст ответа
+    :rtype: str
+    """
+    return f"Сервер {gate.name} перегружен, попробуйте через {config.ADMISSION_RETRY_AFTER} с"
+
+
+#: Ограничение частоты отправки решений
+submit_limiter = RateLimiter(config.ADMISSION_SUBMIT_BURST, config.ADMISSION_SUBMIT_INTERVAL,
+                             config.USER_CACHE_SIZE)
+#: Ограничение частоты получения условий
+condition_limiter = RateLimiter(config.ADMISSION_CONDITION_BURST, config.ADMISSION_CONDITION_INTERVAL,
+                                config.USER_CACHE_SIZE)
+#: Одновременные обращения к kispython
+kispython_gate = UpstreamGate("kispython", config.ADMISSION_KISPYTHON_LIMIT)
+#: Одновременные обращения к black
+black_gate = UpstreamGate("black", config.ADMISSION_BLACK_LIMIT)
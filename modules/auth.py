@@ -1,5 +1,5 @@
-from typing import Dict
 import logging
+import time
 
 from aiogram import Router, Bot, F
 from aiogram.types import Message, ReplyKeyboardRemove, KeyboardButton
@@ -8,10 +8,9 @@ from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.utils.keyboard import ReplyKeyboardBuilder
 
-from aiohttp import ClientSession
-
-from .login import AuthStatus, prepare_session_for_login, login_via_lks
-from .db import UserData
+from .client import client_pool
+from .login import AuthStatus, login_via_lks, login_pool
+from .db import UserData, UserStore
 
 
 logger = logging.getLogger(__name__)
@@ -25,9 +24,11 @@ class AuthData(StatesGroup):
 @auth_router.message(Command("auth"))
 async def start_handler(message: Message, state: FSMContext):
     """
-    Обработчик команды auth, входит в автомат AuthData
+    Обработчик команды auth, входит в автомат AuthData,
+    пока пользователь вводит данные, пул подготавливает сессию для авторизации
     """    
     logger.info(f"Команда auth")
+    login_pool.replenish()
     await state.set_state(AuthData.login_password)
     builder = ReplyKeyboardBuilder()
     builder.add(KeyboardButton(text="cancel"))
@@ -68,7 +69,7 @@ def hide_value(value: str, n: int = 2) -> str:
 
 
 @auth_router.message(AuthData.login_password, F.text)
-async def login_handler(message: Message, bot: Bot, state: FSMContext, db: Dict[int, UserData]):
+async def login_handler(message: Message, bot: Bot, state: FSMContext, db: UserStore):
     """
     Обработчик перехода из состояния ввода логина и пароля
 
@@ -78,8 +79,8 @@ async def login_handler(message: Message, bot: Bot, state: FSMContext, db: Dict[
     :type bot: Bot
     :param state: состояние автомата
     :type state: FSMContext
-    :param db: внутренний кэш с данными пользователей
-    :type db: Dict[int, UserData]
+    :param db: хранилище данных пользователей
+    :type db: UserStore
     :return: None
     :rtype: None
     """
@@ -97,17 +98,17 @@ async def login_handler(message: Message, bot: Bot, state: FSMContext, db: Dict[
     await bot.send_chat_action(message.chat.id, "typing")
 
     user_id = message.from_user.id
-    user_data = db.get(user_id, None)
+    user_data = await db.get(user_id)
 
     if user_data is None or user_data.session_data is None:
-        session = ClientSession()
-        status, session_data = await prepare_session_for_login(session)
+        status, prepared = await login_pool.acquire()
         if status != AuthStatus.SUCCESS:
             return await message.answer(status.get_message())  # Если сервер недоступен или что-то поменялось
-        user_data = UserData(False, 0, session, session_data)
-        db[user_id] = user_data
+        user_data = UserData(False, 0, prepared.cookie_jar, prepared.session_data)
+        await db.set(user_id, user_data)
 
-    status = await login_via_lks(user_data.session, login, password, user_data.session_data)
+    async with client_pool.user_session(user_data.cookie_jar) as session:
+        status = await login_via_lks(session, login, password, user_data.session_data)
     if status != AuthStatus.SUCCESS:
         reply_message += f"\nСтатус: {status.get_message()}\nПопробуйте ещё раз"
         await message.answer(reply_message)
@@ -115,35 +116,41 @@ async def login_handler(message: Message, bot: Bot, state: FSMContext, db: Dict[
             return
     else:
         await message.reply("Авторизация прошла успешно\nПора решать задачи /code")
-        db[user_id].authorized = True
+        user_data.authorized = True
+        user_data.csrf_token = None  # Токен прошлой сессии kispython недействителен
+        user_data.validated = time.monotonic()
+        await db.set(user_id, user_data)
         await state.clear()
 
 
 @auth_router.message(Command("quit"))
-async def quit_handler(message: Message, state: FSMContext, db: Dict[int, UserData]):
+async def quit_handler(message: Message, state: FSMContext, db: UserStore):
     """Обработчик команды quit, удаляет авторизацию пользователя
 
     :param message: сообщение
     :type message: Message
     :param state: состояние автомата
     :type state: FSMContext
-    :param db: внутренний кэш с данными пользователей
-    :type db: Dict[int, UserData]
+    :param db: хранилище данных пользователей
+    :type db: UserStore
     """
     logger.info(f"Команда quit")
     user_id = message.from_user.id
 
-    if db.get(user_id, None) is None or db[user_id].authorized is False:
-        await message.reply("Вы ещё не прошли авторизацию в системе")
+    user_data = await db.get(user_id)
+    if user_data is None:
+        return await message.reply("Вы ещё не прошли авторизацию в системе")
 
-    await db[user_id].session.close()
-    db.pop(user_id)
+    # Удаляются и незавершённые авторизации, чтобы /auth начался с новой сессии
+    await db.delete(user_id)
     await state.clear()
+    if user_data.authorized is False:
+        return await message.reply("Вы ещё не прошли авторизацию в системе")
     await message.reply("Выполнен выход из профиля")
 
 
 @auth_router.message(AuthData.login_password)
-async def login_handler(message: Message, bot: Bot, state: FSMContext, db: Dict[int, UserData]):
+async def login_handler(message: Message, bot: Bot, state: FSMContext, db: UserStore):
     """
     Обработчик некорректного ввода данных в состоянии ввода логина и пароля
     
@@ -153,8 +160,8 @@ async def login_handler(message: Message, bot: Bot, state: FSMContext, db: Dict[
     :type bot: Bot
     :param state: состояние автомата
     :type state: FSMContext
-    :param db: внутренний кэш с данными пользователей
-    :type db: Dict[int, UserData]
+    :param db: хранилище данных пользователей
+    :type db: UserStore
     """
     logger.info(f"Команда login, некорректный ввод")
     await message.answer("Введите корректные данные <login>:<password>")
@@ -0,0 +1,199 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from enum import Enum
+from logging import getLogger
+from typing import AsyncIterator, Dict
+
+from aiohttp import ClientConnectionError, ClientTimeout
+
+from . import config
+
+
+logger = getLogger(__name__)
+
+
+class BreakerState(Enum):
+    """
+    Состояние предохранителя
+    """
+    CLOSED = "closed" #: Запросы выполняются
+    OPEN = "open" #: Запросы сразу отклоняются
+    HALF_OPEN = "half-open" #: Выполняется один пробный запрос
+
+
+class CircuitOpenError(ClientConnectionError):
+    """
+    Запрос отклонён без обращения к сервису, так как предохранитель разомкнут
+
+    Наследуется от ClientConnectionError, поэтому обрабатывается там же,
+    где недоступность сервера
+    """
+
+
+class BreakerCall:
+    """
+    Один запрос через предохранитель
+    """
+    __slots__ = ("failed",)
+
+    def __init__(self):
+        self.failed = False #: Считать ли запрос неудачным, даже если он завершился без исключения
+
+    def check(self, status: int):
+        """
+        Отмечает запрос неудачным, если сервис ответил ошибкой 5xx
+
+        :param status: статус ответа
+        :type status: int
+        """
+        if status >= 500:
+            self.failed = True
+
+
+class CircuitBreaker:
+    """
+    Предохранитель внешнего сервиса
+
+    После failure_threshold неудачных запросов подряд (ошибка соединения, таймаут
+    или ответ 5xx, отмеченный через BreakerCall.check)
+    размыкается, и запросы отклоняются сразу с CircuitOpenError. Через reset_timeout секунд
+    пропускается один пробный запрос: при успехе предохранитель замыкается,
+    при неудаче снова размыкается. Результаты запросов, начатых до последнего
+    размыкания, не учитываются
+
+    :param name: название сервиса
+    :type name: str
+    :param failure_threshold: количество неудач подряд до размыкания
+    :type failure_threshold: int
+    :param reset_timeout: время до пробного запроса, в секундах
+    :type reset_timeout: float
+    :param timeout: таймауты запросов к сервису
+    :type timeout: ClientTimeout
+    """
+    def __init__(self, name: str, failure_threshold: int, reset_timeout: float, timeout: ClientTimeout):
+        self.name = name
+        self.timeout = timeout
+        self.failures = 0 #: Кол-во неудачных запросов подряд
+        self.opened = 0 #: Кол-во размыканий
+        self.rejected = 0 #: Кол-во запросов, отклонённых без обращения к сервису
+        self._failure_threshold = failure_threshold
+        self._reset_timeout = reset_timeout
+        self._state = BreakerState.CLOSED
+        self._opened_at = 0.0
+        self._trial = False
+        self._generation = 0 #: Номер размыкания, к которому относятся новые запросы
+
+    @property
+    def state(self) -> BreakerState:
+        """
+        Текущее состояние, разомкнутый предохранитель по истечении reset_timeout
+        считается полуоткрытым
+        """
+        if self._state is BreakerState.OPEN and time.monotonic() - self._opened_at >= self._reset_timeout:
+            return BreakerState.HALF_OPEN
+        return self._state
+
+    def _set_state(self, state: BreakerState):
+        if state is not self._state:
+            log = logger.info if state is BreakerState.CLOSED else logger.warning
+            log(f"Предохранитель {self.name}: {self._state.value} -> {state.value}")
+            self._state = state
+
+    def allow(self) -> bool:
+        """
+        Решает, можно ли выполнить запрос, и при необходимости начинает пробный запрос
+
+        :return: можно ли выполнить запрос
+        :rtype: bool
+        """
+        state = self.state
+        if state is BreakerState.CLOSED:
+            return True
+        if state is BreakerState.HALF_OPEN and not self._trial:
+            self._set_state(BreakerState.HALF_OPEN)
+            self._trial = True
+            return True
+        self.rejected += 1
+        return False
+
+    def success(self):
+        self._trial = False
+        self.failures = 0
+        self._set_state(BreakerState.CLOSED)
+
+    def failure(self):
+        self._trial = False
+        self.failures += 1
+        if self._state is BreakerState.HALF_OPEN or self.failures >= self._failure_threshold:
+            if self._state is not BreakerState.OPEN:
+                self.opened += 1
+            self._opened_at = time.monotonic()
+            self._generation += 1
+            self._set_state(BreakerState.OPEN)
+
+    @asynccontextmanager
+    async def guard(self) -> AsyncIterator[BreakerCall]:
+        """
+        Контекстный менеджер запроса через предохранитель
+
+        :raises CircuitOpenError: предохранитель разомкнут
+        :return: объект запроса, через который можно сообщить об ответе 5xx
+        :rtype: BreakerCall
+        """
+        if not self.allow():
+            raise CircuitOpenError(f"{self.name} недоступен")
+        call = BreakerCall()
+        generation = self._generation
+        try:
+            yield call
+        except (ClientConnectionError, asyncio.TimeoutError):
+            if generation == self._generation:
+                self.failure()
+            raise
+        except BaseException:
+            if generation != self._generation:
+                raise
+            if call.failed:
+                # Ответ 5xx мог прервать обработку, например проверкой статуса
+                self.failure()
+            else:
+                # Отмена или ошибка разбора не говорят о состоянии сервиса
+                self._trial = False
+            raise
+        if generation != self._generation:
+            # Запрос начат до размыкания, его результат устарел
+            return
+        if call.failed:
+            self.failure()
+        else:
+            self.success()
+
+    def stats(self) -> Dict[str, object]:
+        """
+        Возвращает состояние и счётчики предохранителя
+
+        :return: словарь state, failures, opened, rejected
+        :rtype: Dict[str, object]
+        """
+        return {"state": self.state.value, "failures": self.failures,
+                "opened": self.opened, "rejected": self.rejected}
+
+
+#: Предохранитель kispython
+kispython_breaker = CircuitBreaker(
+    "kispython", config.BREAKER_FAILURES, config.BREAKER_RESET_TIMEOUT,
+    ClientTimeout(total=None, sock_connect=config.KISPYTHON_CONNECT_TIMEOUT, sock_read=config.KISPYTHON_READ_TIMEOUT),
+)
+#: Предохранитель ЛКС, через который kispython авторизует пользователей
+lks_breaker = CircuitBreaker(
+    "ЛКС", config.BREAKER_FAILURES, config.BREAKER_RESET_TIMEOUT,
+    ClientTimeout(total=None, sock_connect=config.KISPYTHON_CONNECT_TIMEOUT, sock_read=config.KISPYTHON_READ_TIMEOUT),
+)
+#: Предохранитель black сервера
+black_breaker = CircuitBreaker(
+    "black", config.BREAKER_FAILURES, config.BREAKER_RESET_TIMEOUT,
+    ClientTimeout(total=None, sock_connect=config.BLACK_CONNECT_TIMEOUT, sock_read=config.BLACK_READ_TIMEOUT),
+)
+#: Все предохранители по названию сервиса
+breakers = {breaker.name: breaker for breaker in (kispython_breaker, lks_breaker, black_breaker)}
@@ -0,0 +1,309 @@
+import asyncio
+import hashlib
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple, Union
+
+from cachetools import LRUCache, TTLCache
+
+from . import config
+
+
+@dataclass(slots=True)
+class ConditionPage:
+    """
+    Разобранная страница с условиями задачи
+    """
+    fragments: Dict[int, str] #: Словарь вариант -> html фрагмент
+    complete: bool = True #: Разобрана ли страница целиком, а не только её начало
+    etag: Union[str, None] = None #: Заголовок ETag ответа, для условного запроса
+    last_modified: Union[str, None] = None #: Заголовок Last-Modified ответа, для условного запроса
+
+
+class ConditionCache:
+    """
+    Кэш страниц с условиями задач (TTL + LRU)
+
+    Каждая страница ``https://kispython.ru/docs/{task}/{group}.html``
+    разбирается один раз и хранится как ConditionPage
+    со словарём ``вариант -> html фрагмент``
+    """
+    def __init__(self, maxsize: int, ttl: int):
+        self.hits = 0 #: Кол-во попаданий в кэш
+        self.misses = 0 #: Кол-во промахов
+        self._ttl = ttl
+        self._pages = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    def get(self, url: str) -> Union[ConditionPage, None]:
+        """
+        Возвращает страницу или None, если страницы нет в кэше
+
+        :param url: ссылка на страницу без якоря
+        :type url: str
+        :return: разобранная страница
+        :rtype: Union[ConditionPage, None]
+        """
+        page = self._pages.get(url)
+        if page is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return page
+
+    def peek(self, url: str) -> Union[ConditionPage, None]:
+        """
+        Возвращает страницу без учёта в статистике попаданий
+
+        :param url: ссылка на страницу без якоря
+        :type url: str
+        :return: разобранная страница
+        :rtype: Union[ConditionPage, None]
+        """
+        return self._pages.get(url)
+
+    @property
+    def maxsize(self) -> int:
+        """
+        Максимальное количество страниц в кэше
+        """
+        return int(self._pages.maxsize)
+
+    def reserve(self, size: int) -> bool:
+        """
+        Увеличивает кэш, чтобы в нём помещалось не меньше size страниц,
+        сохранённые страницы переносятся
+
+        :param size: необходимое количество страниц
+        :type size: int
+        :return: был ли кэш увеличен
+        :rtype: bool
+        """
+        if size <= self.maxsize:
+            return False
+        pages = TTLCache(maxsize=size, ttl=self._ttl)
+        # Перенесённые страницы получают новое время жизни, актуальность проверит ConditionWarmer
+        pages.update(self._pages.items())
+        self._pages = pages
+        return True
+
+    def set(self, url: str, page: ConditionPage):
+        """
+        Сохраняет страницу
+
+        :param url: ссылка на страницу без якоря
+        :type url: str
+        :param page: разобранная страница
+        :type page: ConditionPage
+        """
+        # Повторная запись продлевает время жизни страницы
+        self._pages[url] = page
+
+    def merge(self, url: str, page: ConditionPage) -> ConditionPage:
+        """
+        Дополняет сохранённую страницу вариантами из частично загруженной
+
+        :param url: ссылка на страницу без якоря
+        :type url: str
+        :param page: разобранное начало страницы
+        :type page: ConditionPage
+        :return: объединённая страница
+        :rtype: ConditionPage
+        """
+        cached = self._pages.get(url)
+        if cached is not None and not page.complete:
+            page = ConditionPage({**cached.fragments, **page.fragments}, cached.complete)
+        self._pages[url] = page
+        return page
+
+    def __len__(self):
+        return len(self._pages)
+
+
+class FormatCache:
+    """
+    Кэш результатов форматирования black по хэшу исходного кода (LRU)
+
+    Хранятся только однозначные ответы: 200, 204 и 400
+    """
+    #: Статусы, которые можно кэшировать
+    STATUSES = (200, 204, 400)
+
+    def __init__(self, maxsize: int):
+        self.hits = 0 #: Кол-во попаданий в кэш
+        self.misses = 0 #: Кол-во промахов
+        self._results = LRUCache(maxsize=maxsize)
+
+    @staticmethod
+    def key(code: str) -> str:
+        """
+        Возвращает ключ кэша для исходного кода
+
+        :param code: код программы
+        :type code: str
+        :return: sha256 кода
+        :rtype: str
+        """
+        return hashlib.sha256(code.encode("utf-8")).hexdigest()
+
+    def get(self, code: str) -> Union[Tuple[Union[str, None], int], None]:
+        """
+        Возвращает сохранённый результат форматирования или None
+
+        :param code: код программы
+        :type code: str
+        :return: отформатированный код и статус или None
+        :rtype: Union[Tuple[Union[str, None], int], None]
+        """
+        result = self._results.get(self.key(code))
+        if result is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return result
+
+    def set(self, code: str, result: Tuple[Union[str, None], int]):
+        """
+        Сохраняет результат форматирования, если статус однозначный
+
+        :param code: код программы
+        :type code: str
+        :param result: отформатированный код и статус
+        :type result: Tuple[Union[str, None], int]
+        """
+        if result[1] in self.STATUSES:
+            self._results[self.key(code)] = result
+
+    def __len__(self):
+        return len(self._results)
+
+
+class FileIdCache:
+    """
+    Кэш file_id документов с условиями, уже загруженных в Telegram (LRU)
+
+    Ключ - задача, группа, вариант и хэш содержимого файла,
+    повторная отправка того же файла не требует загрузки
+    """
+    def __init__(self, maxsize: int):
+        self.hits = 0 #: Кол-во попаданий в кэш
+        self.misses = 0 #: Кол-во промахов
+        self._file_ids = LRUCache(maxsize=maxsize)
+
+    @staticmethod
+    def key(task: Union[int, str], group: str, variant: int, content: bytes) -> Tuple[str, str, int, str]:
+        """
+        Возвращает ключ кэша для документа
+
+        :param task: Номер задания (индекс)
+        :type task: Union[int, str]
+        :param group: Название группы
+        :type group: str
+        :param variant: Номер варианта
+        :type variant: int
+        :param content: Содержимое файла
+        :type content: bytes
+        :return: ключ кэша
+        :rtype: Tuple[str, str, int, str]
+        """
+        return str(task), group, int(variant), hashlib.sha256(content).hexdigest()
+
+    def get(self, key: Tuple[str, str, int, str]) -> Union[str, None]:
+        """
+        Возвращает file_id или None
+
+        :param key: ключ, возвращённый FileIdCache.key
+        :type key: Tuple[str, str, int, str]
+        :return: file_id документа в Telegram
+        :rtype: Union[str, None]
+        """
+        file_id = self._file_ids.get(key)
+        if file_id is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return file_id
+
+    def set(self, key: Tuple[str, str, int, str], file_id: str):
+        """
+        Сохраняет file_id загруженного документа
+
+        :param key: ключ, возвращённый FileIdCache.key
+        :type key: Tuple[str, str, int, str]
+        :param file_id: file_id документа в Telegram
+        :type file_id: str
+        """
+        self._file_ids[key] = file_id
+
+    def pop(self, key: Tuple[str, str, int, str]):
+        """
+        Удаляет file_id, который Telegram перестал принимать
+
+        :param key: ключ, возвращённый FileIdCache.key
+        :type key: Tuple[str, str, int, str]
+        """
+        self._file_ids.pop(key, None)
+
+    def __len__(self):
+        return len(self._file_ids)
+
+
+class SingleFlight:
+    """
+    Объединяет одинаковые одновременные запросы в один
+
+    Пока запрос с ключом key выполняется, остальные вызовы с тем же ключом
+    ожидают его завершения и получают тот же результат (или исключение)
+    """
+    def __init__(self):
+        self.coalesced = 0 #: Кол-во запросов, присоединившихся к уже выполняющимся
+        self._in_flight: Dict[Hashable, asyncio.Task] = {}
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Выполняет func() или ожидает уже выполняющийся запрос с тем же ключом
+
+        :param key: ключ запроса
+        :type key: Hashable
+        :param func: функция, возвращающая корутину запроса
+        :type func: Callable[[], Awaitable[Any]]
+        :return: результат запроса
+        :rtype: Any
+        """
+        task = self._in_flight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(func())
+            self._in_flight[key] = task
+            task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        else:
+            self.coalesced += 1
+        # Отмена одного из ожидающих не должна отменять запрос для остальных
+        return await asyncio.shield(task)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._in_flight
+
+    def __len__(self):
+        return len(self._in_flight)
+
+
+#: Общий кэш страниц с условиями
+condition_cache = ConditionCache(config.CONDITION_CACHE_SIZE, config.CONDITION_CACHE_TTL)
+#: Общий кэш результатов форматирования
+format_cache = FormatCache(config.FORMAT_CACHE_SIZE)
+#: Общий кэш file_id документов с условиями
+file_id_cache = FileIdCache(config.FILE_ID_CACHE_SIZE)
+#: Объединение одновременных загрузок и разборов страниц с условиями
+condition_flight = SingleFlight()
+
+
+def cache_stats() -> Dict[str, Dict[str, int]]:
+    """
+    Возвращает счётчики общих кэшей и объединения запросов
+
+    :return: словарь кэш -> hits, misses, size и condition_flight -> coalesced, in_flight
+    :rtype: Dict[str, Dict[str, int]]
+    """
+    caches = {"condition_cache": condition_cache, "format_cache": format_cache, "file_id_cache": file_id_cache}
+    return {
+        **{name: {"hits": cache.hits, "misses": cache.misses, "size": len(cache)} for name, cache in caches.items()},
+        "condition_flight": {"coalesced": condition_flight.coalesced, "in_flight": len(condition_flight)},
+    }
@@ -0,0 +1,111 @@
+from logging import getLogger
+from typing import Dict, List, Union
+
+from aiohttp import ClientConnectionError
+
+from . import config
+from .client import client_pool
+from .login import parse_tasks
+from .outbound import Priority, kispython_scheduler
+from .parsing import parse_executor, extract_groups
+from .periodic import PeriodicTask
+
+
+logger = getLogger(__name__)
+
+#: Страница со списком групп
+GROUPS_URL = "https://kispython.ru/"
+
+#: Группы на случай, если kispython недоступен при запуске
+DEFAULT_GROUPS = [f"ИВБО-{i:02}-22" for i in range(1, 10)]
+DEFAULT_GROUPS += [f"ИКБО-{i:02}-22" for i in range(1, 37) if i not in [10, 24, 29, 34]]
+DEFAULT_GROUPS += [f"ИМБО-{i:02}-22" for i in range(1, 3)]
+DEFAULT_GROUPS += [f"ИНБО-{i:02}-22" for i in range(1, 13)]
+#: Количество задач на случай, если kispython недоступен при запуске
+DEFAULT_TASK_COUNT = 12
+#: Количество вариантов
+DEFAULT_VARIANT_COUNT = 40
+
+
+class Catalog(PeriodicTask):
+    """
+    Каталог групп, задач и вариантов kispython
+
+    Список групп и количество задач загружаются с kispython и обновляются
+    в фоне раз в ttl секунд, до первой загрузки используются значения по умолчанию.
+    Поиск id группы по названию и названия по id выполняется за O(1)
+
+    :param ttl: период обновления, в секундах
+    :type ttl: float
+    """
+    error_text = "Ошибка обновления каталога"
+
+    def __init__(self, ttl: float):
+        super().__init__(ttl)
+        self.version = 0 #: Номер версии, увеличивается при каждом изменении каталога
+        self._set_groups(dict(enumerate(DEFAULT_GROUPS)))
+        self._set_tasks(DEFAULT_TASK_COUNT)
+        self.variants: List[int] = list(range(1, DEFAULT_VARIANT_COUNT + 1)) #: Номера вариантов
+
+    def _set_groups(self, groups: Dict[int, str]):
+        self._name_by_id = dict(sorted(groups.items()))
+        self._id_by_name = {name: group_id for group_id, name in self._name_by_id.items()}
+        self.groups: List[str] = list(self._name_by_id.values()) #: Названия групп в порядке id
+
+    def _set_tasks(self, count: int):
+        self.tasks: List[int] = list(range(1, count + 1)) #: Номера задач
+
+    def group_id(self, name: str) -> int:
+        """
+        Возвращает id группы по названию
+
+        :param name: Название группы
+        :type name: str
+        :return: id группы на kispython
+        :rtype: int
+        """
+        return self._id_by_name[name]
+
+    def group_name(self, group_id: Union[int, str]) -> str:
+        """
+        Возвращает название группы по id
+
+        :param group_id: id группы на kispython
+        :type group_id: Union[int, str]
+        :return: Название группы
+        :rtype: str
+        """
+        return self._name_by_id[int(group_id)]
+
+    async def refresh(self):
+        """
+        Загружает список групп и количество задач с kispython,
+        при ошибке сохраняет прежние значения
+        """
+        groups = None
+        try:
+            async with kispython_scheduler.slot(Priority.BACKGROUND) as call, client_pool.session.get(GROUPS_URL) as page:
+                call.check(page.status)
+                if page.status == 200:
+                    groups = await parse_executor.run(extract_groups, await page.read())
+        except ClientConnectionError as E:
+            logger.error(f"Не удалось получить список групп {E}")
+        task_count = await parse_tasks(client_pool.session)
+
+        changed = False
+        if groups and groups != self._name_by_id:
+            self._set_groups(groups)
+            changed = True
+        if task_count and task_count != len(self.tasks):
+            self._set_tasks(task_count)
+            changed = True
+        if changed:
+            self.version += 1
+            logger.info(f"Каталог обновлён: групп {len(self.groups)}, задач {len(self.tasks)}")
+
+    async def tick(self):
+        await self.refresh()
+
+
+#: Общий каталог групп, задач и вариантов
+catalog = Catalog(config.CATALOG_TTL)
@@ -0,0 +1,85 @@
+from typing import Union
+from logging import getLogger
+
+from aiohttp import ClientSession, TCPConnector, DummyCookieJar, CookieJar
+
+from . import config
+from .breaker import kispython_breaker
+
+
+logger = getLogger(__name__)
+
+
+class ClientPool:
+    """
+    Общий для всего приложения пул HTTP соединений
+
+    Создаётся при запуске бота (start) и закрывается при остановке (close),
+    все анонимные запросы к kispython и black идут через session,
+    запросы от имени пользователя - через user_session с его cookie.
+    По умолчанию у сессий таймауты kispython (kispython_breaker.timeout)
+    """
+    def __init__(self):
+        self._connector: Union[TCPConnector, None] = None
+        self._session: Union[ClientSession, None] = None
+
+    def start(self):
+        """
+        Создаёт соединитель и анонимную сессию, должен вызываться внутри цикла событий
+        """
+        if self._session is not None and not self._session.closed:
+            return
+        self._connector = TCPConnector(
+            limit=config.HTTP_POOL_LIMIT,
+            limit_per_host=config.HTTP_POOL_LIMIT_PER_HOST,
+            ttl_dns_cache=config.HTTP_DNS_TTL,
+            use_dns_cache=True,
+            keepalive_timeout=config.HTTP_KEEPALIVE_TIMEOUT,
+        )
+        # Анонимные запросы не должны накапливать cookies
+        self._session = ClientSession(connector=self._connector, cookie_jar=DummyCookieJar(),
+                                      timeout=kispython_breaker.timeout)
+        logger.info("Пул HTTP соединений создан")
+
+    @property
+    def session(self) -> ClientSession:
+        """
+        Анонимная сессия поверх общего соединителя
+
+        :return: сессия
+        :rtype: ClientSession
+        """
+        if self._session is None or self._session.closed:
+            self.start()
+        return self._session
+
+    def user_session(self, cookie_jar: CookieJar) -> ClientSession:
+        """
+        Лёгкая сессия пользователя поверх общего соединителя
+
+        Закрытие такой сессии не закрывает соединения пула,
+        все cookie авторизации сохраняются в cookie_jar
+
+        :param cookie_jar: cookie пользователя
+        :type cookie_jar: CookieJar
+        :return: сессия
+        :rtype: ClientSession
+        """
+        if self._session is None or self._session.closed:
+            self.start()
+        return ClientSession(connector=self._connector, connector_owner=False, cookie_jar=cookie_jar,
+                             timeout=kispython_breaker.timeout)
+
+    async def close(self):
+        """
+        Закрывает анонимную сессию и все соединения пула
+        """
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+        self._connector = None
+        logger.info("Пул HTTP соединений закрыт")
+
+
+#: Общий пул HTTP соединений
+client_pool = ClientPool()
@@ -1,25 +1,39 @@
 import asyncio
-import re
-from typing import Dict, Any, Union, Tuple
+import codecs
+from html import escape
+from typing import Any, List, Union, Tuple
 from logging import getLogger
 
-from aiohttp import ClientSession, ClientConnectionError
+from aiohttp import ClientConnectionError, CookieJar
 from aiogram import Router, F, Bot
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.types import Message, CallbackQuery, BufferedInputFile
 from aiogram.filters import Command, or_f
-from aiogram.filters.state import State, StatesGroup
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from bs4 import BeautifulSoup, NavigableString
 
 from aiogram_dialog import Window, Dialog, DialogManager, StartMode
-from aiogram_dialog.widgets.kbd import ScrollingGroup, Back, Select, Column
+from aiogram_dialog.api.internal import CONTEXT_KEY
+from aiogram_dialog.utils import remove_indent_id
+from aiogram_dialog.widgets.kbd import Back, Select, Column
 from aiogram_dialog.widgets.text import Const, Format
-from aiogram_dialog.widgets.input import MessageInput, TextInput
-from aiogram.types import ContentType, Message
-
-from .db import UserData
-from .middleware import AuthMiddleware
+from aiogram_dialog.widgets.input import MessageInput
+from aiogram.types import ContentType
+
+from . import config
+from .admission import GateBusy, black_gate, busy_text, condition_limiter, kispython_gate, submit_limiter
+from .breaker import BreakerState, kispython_breaker
+from .catalog import catalog
+from .client import client_pool
+from .cache import ConditionPage, FileIdCache, condition_cache, condition_flight, file_id_cache
+from .db import UserData, UserStore
+from .keyboards import CachedScrollingGroup
+from .login import AuthStatus
+from .formatter import format_code
+from .middleware import AdmissionMiddleware, AuthMiddleware
+from .outbound import Priority, kispython_scheduler
+from .parsing import HeadingWatcher, parse_executor, split_variants, extract_csrf_token
+from .verdict import verdict_scheduler
 
 template = """<!DOCTYPE html>
 <html lang="en">
@@ -50,26 +64,16 @@ class CodeStates(StatesGroup):
     code = State()
 
 
-groups = [f"ИВБО-{i:02}-22" for i in range(1, 10)]
-groups += [f"ИКБО-{i:02}-22" for i in range(1, 37) if i not in [10, 24, 29, 34]]
-groups += [f"ИМБО-{i:02}-22" for i in range(1, 3)]
-groups += [f"ИНБО-{i:02}-22" for i in range(1, 13)]
-
-tasks = [i for i in range(1, 13)]
-
-variants = [i for i in range(1, 41)]
-
-
 async def get_primary_data(*args, **kwargs):
     """
     Формирует данные для отображения в виждетах
 
     :return: Словарь с данными
-    :rtype: Dict[str, List[str, ...]]
+    :rtype: dict
     """
-    return {"groups": groups,
-            "tasks": tasks,
-            "variants": variants}
+    return {"groups": catalog.groups,
+            "tasks": catalog.tasks,
+            "variants": catalog.variants}
 
 
 async def get_content(link: str):
@@ -82,80 +86,172 @@ async def get_content(link: str):
     :return: Текст страницы
     :rtype: str
     """
-    async with ClientSession() as session:
-        async with session.get(link) as page:
-            assert page.status == 200
-            text = await page.text('utf-8')
+    async with kispython_scheduler.slot(Priority.CONDITION) as call, client_pool.session.get(link) as page:
+        call.check(page.status)
+        assert page.status == 200
+        text = await page.text('utf-8')
     return text
 
 
+async def fetch_content_until(link: str, heading_id: str) -> Tuple[str, bool]:
+    """
+    Потоково загружает страницу до заголовка <h2> с id heading_id
+
+    Ответ читается по частям и передаётся инкрементальному парсеру,
+    после появления заголовка чтение прекращается, а соединение закрывается
+
+    :param link: Ссылка на страницу
+    :type link: str
+    :param heading_id: id заголовка, перед которым чтение прекращается
+    :type heading_id: str
+    :return: Начало страницы до заголовка и признак, что страница прочитана целиком
+    :rtype: Tuple[str, bool]
+    """
+    decoder = codecs.getincrementaldecoder('utf-8')('replace')
+    watcher = HeadingWatcher(heading_id)
+    chunks = []
+    async with kispython_scheduler.slot(Priority.CONDITION) as call, client_pool.session.get(link) as page:
+        call.check(page.status)
+        assert page.status == 200
+        async for chunk in page.content.iter_chunked(config.CONDITION_STREAM_CHUNK):
+            text = decoder.decode(chunk)
+            chunks.append(text)
+            watcher.feed(text)
+            if watcher.found is not None:
+                content = "".join(chunks)
+                return content[:content.find(watcher.found)], False
+    chunks.append(decoder.decode(b'', final=True))
+    return "".join(chunks), True
+
+
+async def load_condition_page(url: str) -> ConditionPage:
+    """Загружает страницу с заданием, разбирает её на варианты и сохраняет в кэш
+
+    :param url: Ссылка на страницу с заданием без якоря
+    :type url: str
+    :raises GateBusy: kispython перегружен
+    :return: Разобранная страница
+    :rtype: ConditionPage
+    """
+    with kispython_gate.hold():
+        content = await get_content(url)
+    page = ConditionPage(await parse_executor.run(split_variants, content))
+    condition_cache.set(url, page)
+    return page
+
+
+async def load_condition_prefix(url: str, variant: int) -> ConditionPage:
+    """Потоково загружает страницу с заданием до следующего за variant варианта,
+    разбирает загруженное начало и дополняет им кэш
+
+    :param url: Ссылка на страницу с заданием без якоря
+    :type url: str
+    :param variant: Номер варианта
+    :type variant: int
+    :raises GateBusy: kispython перегружен
+    :return: Разобранная страница (возможно, не целиком)
+    :rtype: ConditionPage
+    """
+    with kispython_gate.hold():
+        content, complete = await fetch_content_until(url, f"вариант-{variant + 1}")
+    page = ConditionPage(await parse_executor.run(split_variants, content), complete)
+    return condition_cache.merge(url, page)
+
+
 async def get_task_condition_html(link: str, variant: int) -> Union[str, None]:
     """Возвращает html код страницы с условием задачи варианта
 
+    Страница разбирается на варианты один раз и сохраняется в condition_cache,
+    последующие запросы любого варианта этой страницы берутся из кэша.
+    Одновременные промахи по одной странице ожидают одну загрузку.
+    При CONDITION_STREAMING загружается только начало страницы до следующего варианта,
+    если страница уже не загружается целиком (например, ConditionWarmer)
+
     :param link: Ссылка на страницу с заданием
     :type link: str
     :param variant: Номер варианта
     :type variant: int
+    :raises GateBusy: при промахе кэша kispython перегружен
     :return: html код страницы или None
     :rtype: Union[str, None]
     """
     logger.info(f"Получение условия для задачи {link} {variant}...")
-    try:
-        content = await get_content(link)
-    except (AssertionError, ClientConnectionError):
-        logger.error(f"Не удалось получить условие {link} {variant}")
-        return
-
-    parse = BeautifulSoup(content, "html.parser")
-    tag = parse.find(name="h2", id=f"вариант-{variant}")
-    next_variant = f"вариант-{variant + 1}"
-    html = str(tag)
-
-    def skip_br(tag):
-        # Пропускает NavigableString "\n"
-        if isinstance(tag, NavigableString):
-            return tag.next_sibling
-        return tag
-
-    next_sibling = skip_br(tag.next_sibling)
+    url = link.split("#")[0]
+    variant = int(variant)
+    page = condition_cache.get(url)
+    if page is None or (variant not in page.fragments and not page.complete):
+        try:
+            if config.CONDITION_STREAMING and url not in condition_flight:
+                page = await condition_flight.do((url, variant), lambda: load_condition_prefix(url, variant))
+            else:
+                page = await condition_flight.do(url, lambda: load_condition_page(url))
+        except (AssertionError, ClientConnectionError):
+            logger.error(f"Не удалось получить условие {link} {variant}")
+            return
 
-    while next_sibling is not None and next_sibling.attrs.get('id') != next_variant:
-        html += str(next_sibling)
-        next_sibling = skip_br(next_sibling.next_sibling)
+    html = page.fragments.get(variant)
+    if html is None:
+        logger.error(f"Вариант {variant} не найден на странице {url}")
+        return
     logger.info(f"Условие получено")
     return template.format(html)
 
 
-async def format_code(code: str) -> Tuple[Union[str, None], int]:
+def condition_page_url(task: Union[int, str], group: str) -> str:
+    """
+    Возвращает ссылку на страницу с условиями задачи для группы
+
+    :param task: Номер задания, на 1 меньше фактического (индекс)
+    :type task: Union[int, str]
+    :param group: Название группы
+    :type group: str
+    :return: Ссылка на страницу без якоря
+    :rtype: str
     """
-    Форматирует python-код в соответствии с PEP-8
+    return f"https://kispython.ru/docs/{task}/{group}.html"
 
-    Возвращает отформатированный код и статус ответа:
 
-    * Статус 200, код был отформатирован возвращает код
-    * Статус 204, код был в соответствии с PEP-8 возвращает исходный код
-    * Статус 400, синтаксическая ошибка возвращает None
-    * Статус 500, иная ошибка (сервера) возвращает исходный код
+def condition_page_urls() -> List[str]:
+    """
+    Возвращает ссылки на страницы с условиями всех задач всех групп
 
-    :param code: код программы
-    :type code: str
-    :return: отформатировнный код программы или None
-    :rtype: Tuple[Union[str, None], int]
+    :return: Список ссылок
+    :rtype: List[str]
     """
+    return [condition_page_url(task - 1, group) for group in catalog.groups for task in catalog.tasks]
+
 
-    async with ClientSession() as session:
+async def send_condition(bot: Bot, chat_id: int, html: str, file_name: str,
+                         task: Union[int, str], group: str, variant: int):
+    """
+    Отправляет документ с условием, повторно используя file_id уже загруженного файла
+
+    :param bot: бот
+    :type bot: Bot
+    :param chat_id: id чата
+    :type chat_id: int
+    :param html: html код страницы с условием
+    :type html: str
+    :param file_name: имя файла
+    :type file_name: str
+    :param task: Номер задания (индекс)
+    :type task: Union[int, str]
+    :param group: Название группы
+    :type group: str
+    :param variant: Номер варианта
+    :type variant: int
+    """
+    content = html.encode('utf-8')
+    key = FileIdCache.key(task, group, variant, content)
+    if (file_id := file_id_cache.get(key)) is not None:
         try:
-            logger.debug('Отправка кода на форматирование к black серверу')
-            async with session.post("http://black:9090", data=code.encode('utf-8')) as response:
-                logger.debug('Ответ от black', response.status)
-                if response.status == 200:
-                    text = await response.text('utf-8')
-                    return text, response.status
-                else:
-                    return code, response.status
-        except ClientConnectionError as E:
-            logger.error(f'Не удалось подключиться к black серверу, {E}')
-            return None, 404
+            await bot.send_document(chat_id, file_id)
+            return
+        except TelegramBadRequest as E:
+            logger.warning(f"file_id условия больше не действителен, {E}")
+            file_id_cache.pop(key)
+    message = await bot.send_document(chat_id, BufferedInputFile(content, file_name))
+    file_id_cache.set(key, message.document.file_id)
 
 
 async def on_group_selected(callback: CallbackQuery, widget: Any,
@@ -192,45 +288,198 @@ async def on_task_selected(callback: CallbackQuery, widget: Any,
     chat_id = manager._data.get('event_chat').id
 
     data = manager.dialog_data
-    condition_url = (
-            f"https://kispython.ru/docs/{data['task']}/" +
-            f"{groups[int(data['group'])]}.html#вариант-{data['variant']}"
-    )
+    group_name = catalog.group_name(data['group'])
+    condition_url = f"{condition_page_url(data['task'], group_name)}#вариант-{data['variant']}"
 
     manager.dialog_data['condition'] = condition_url
-    file_name = f"{int(data['task']) + 1}_{groups[int(data['group'])]}_вариант-{data['variant']}.html"
+    file_name = f"{int(data['task']) + 1}_{group_name}_вариант-{data['variant']}.html"
 
-    html = await get_task_condition_html(condition_url, data['variant'])
+    try:
+        html = await get_task_condition_html(condition_url, data['variant'])
+    except GateBusy as E:
+        condition_limiter.refund(callback.from_user.id)
+        return await bot.send_message(chat_id, busy_text(E.gate))
+    if html is None and kispython_breaker.state is not BreakerState.CLOSED:
+        return await bot.send_message(chat_id, AuthStatus.SERVER_UNAVAILABLE.get_message())
     if html is None:
         return await bot.send_message(chat_id, "К сожалению, условие не найдено")
 
-    await bot.send_document(chat_id, BufferedInputFile(html.encode('utf-8'), file_name))
+    await send_condition(bot, chat_id, html, file_name, data['task'], group_name, data['variant'])
     await bot.send_message(chat_id, "Отправьте следующим сообщением Ваше решение выбранной задачи")
     await manager.switch_to(CodeStates.code)
 
 
-async def expect_verdict(session: ClientSession, link: str):
-    for _ in range(10):
-        await asyncio.sleep(3)
-        async with session.get(link) as page:
+async def expect_verdict(cookie_jar: CookieJar, link: str, user_data: Union[UserData, None] = None):
+    """
+    Ожидает результат проверки отправленного решения через общий планировщик
+
+    :param cookie_jar: cookie авторизованного пользователя
+    :type cookie_jar: CookieJar
+    :param link: Ссылка на страницу задачи
+    :type link: str
+    :param user_data: данные пользователя, в них сохраняется свежий csrf_token со страницы задачи
+    :type user_data: Union[UserData, None], опционально
+    :return: Статус проверки и сообщение
+    :rtype: Tuple[str, Union[str, None]]
+    """
+    on_token = None
+    if user_data is not None:
+        def on_token(token: str):
+            user_data.csrf_token = token
+    return await verdict_scheduler.wait(cookie_jar, link, on_token)
+
+
+async def fetch_submit_token(cookie_jar: CookieJar, link: str) -> Union[str, None]:
+    """
+    Возвращает csrf_token формы отправки решения или None
+
+    :param cookie_jar: cookie авторизованного пользователя
+    :type cookie_jar: CookieJar
+    :param link: Ссылка на страницу задачи
+    :type link: str
+    :return: Токен или None
+    :rtype: Union[str, None]
+    """
+    try:
+        async with kispython_scheduler.slot(Priority.CRITICAL) as call, \
+                client_pool.user_session(cookie_jar) as user_session, user_session.get(link) as page:
+            call.check(page.status)
             if page.status != 200:
-                break
+                return None
             content = await page.read()
-            parse = BeautifulSoup(content, "html.parser")
-            if (status_tag := parse.find(name="div", attrs={"class": re.compile("^badge alert")})) is None:
-                continue
-            status = status_tag.text.strip()
-            if "Отправлено" in status:
-                continue
-            msg_tag = parse.find(name="div", attrs={"class": "text-muted mb-2"})
-            msg = msg_tag.text
-            if msg_tag.parent.name == "form":
-                msg = parse.find(name="div", attrs={"class": "callout callout-success"})
-                msg = msg.find("div").text + "\n" + msg.find("small").text
-
-            return status, msg
-    status = "Произошла непредвиденная ошибка"
-    return status, None
+    except ClientConnectionError as E:
+        logger.error(f"Не удалось получить csrf_token {E}")
+        return None
+    return await parse_executor.run(extract_csrf_token, content)
+
+
+async def post_solution(cookie_jar: CookieJar, link: str, code: str, token: str) -> int:
+    """
+    Отправляет решение и возвращает статус ответа
+
+    :param cookie_jar: cookie авторизованного пользователя
+    :type cookie_jar: CookieJar
+    :param link: Ссылка на страницу задачи
+    :type link: str
+    :param code: код решения
+    :type code: str
+    :param token: csrf_token формы отправки решения
+    :type token: str
+    :return: Статус ответа, 400 - токен отклонён, 503 - сервер недоступен
+    :rtype: int
+    """
+    data = {
+        "code": code,
+        "csrf_token": token
+    }
+    try:
+        async with kispython_scheduler.slot(Priority.CRITICAL) as call, \
+                client_pool.user_session(cookie_jar) as user_session, user_session.post(link, data=data) as page:
+            call.check(page.status)
+            return page.status
+    except ClientConnectionError as E:
+        logger.error(f"Не удалось отправить решение {E}")
+        return 503
+
+
+def error_text() -> str:
+    """
+    Возвращает сообщение об ошибке обращения к kispython
+
+    :return: текст сообщения
+    :rtype: str
+    """
+    if kispython_breaker.state is not BreakerState.CLOSED:
+        return AuthStatus.SERVER_UNAVAILABLE.get_message()
+    return "Произошла ошибка"
+
+
+#: Максимальная длина кода в уведомлении, сообщение Telegram ограничено 4096 символами
+NOTICE_CODE_LIMIT = 3800
+
+
+def format_notice(code: str, status: int) -> Tuple[str, Union[str, None]]:
+    """
+    Возвращает уведомление о результате форматирования и режим разметки
+
+    Код передаётся в html разметке, поэтому обратные кавычки в нём не ломают сообщение,
+    слишком длинный код сокращается до NOTICE_CODE_LIMIT символов
+
+    :param code: отформатированный код
+    :type code: str
+    :param status: статус форматирования, см. format_code
+    :type status: int
+    :return: текст сообщения и parse_mode
+    :rtype: Tuple[str, Union[str, None]]
+    """
+    if status == 200:
+        shown = code if len(code) <= NOTICE_CODE_LIMIT else code[:NOTICE_CODE_LIMIT] + "\n..."
+        header = "Отформатированный код" if shown is code else "Начало отформатированного кода"
+        return ("Ваш код был отформатирован в соответствии с требованиями pep-8\n"
+                f"{header}:\n<pre><code class=\"language-python\">{escape(shown)}</code></pre>"), "HTML"
+    elif status == 204:
+        return "Ваш код соответствует формату pep-8, изменений не произведено", None
+    elif status == 400:
+        return "Ваш код содержит синтаксические ошибки, отправка решения отменена", None
+    return "Произошла внутренняя ошибка. Проверка на соответствие формату pep-8 не выполнена", None
+
+
+#: Уведомления, отправляемые в фоне (ссылки удерживаются до завершения)
+background_tasks = set()
+
+
+def send_in_background(coro) -> asyncio.Task:
+    """
+    Выполняет отправку сообщения в фоне, не задерживая обработчик
+
+    :param coro: корутина отправки
+    :return: задача отправки
+    :rtype: asyncio.Task
+    """
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    task.add_done_callback(log_background_error)
+    return task
+
+
+def log_background_error(task: asyncio.Task):
+    """
+    Записывает в лог ошибку фоновой отправки, иначе она теряется в asyncio.gather
+
+    :param task: завершённая задача отправки
+    :type task: asyncio.Task
+    """
+    if not task.cancelled() and (error := task.exception()) is not None:
+        logger.error(f"Не удалось отправить сообщение в фоне {error}")
+
+
+def is_valid_source(text: Union[str, None]) -> bool:
+    """
+    Проверяет, что сообщение может быть решением: от 10 до 10⁴ символов
+
+    :param text: текст сообщения
+    :type text: Union[str, None]
+    :return: подходит ли длина
+    :rtype: bool
+    """
+    return text is not None and 10 <= len(text) + 1 <= 10 ** 4
+
+
+def is_submission(message: Message, data: dict) -> bool:
+    """
+    Проверяет, что сообщение в диалоге - отправка решения, а не случайный текст
+    в окнах выбора или решение недопустимой длины
+
+    :param message: сообщение
+    :type message: Message
+    :param data: данные обработчика
+    :type data: dict
+    :return: будет ли решение отправлено на kispython
+    :rtype: bool
+    """
+    context = data.get(CONTEXT_KEY)
+    return context is not None and context.state == CodeStates.code and is_valid_source(message.text)
 
 
 async def solve_handler(
@@ -239,54 +488,86 @@ async def solve_handler(
         manager: DialogManager):
     """
     Обработчик события отправления пользователем решения задачи
+
+    Обычно используется последний известный csrf_token пользователя, и решение
+    сразу отправляется POST запросом; если сервер отклонил токен, он запрашивается
+    заново и отправка повторяется один раз. Если токена нет, его получение
+    и форматирование кода выполняются одновременно.
+    Уведомление о форматировании отправляется в фоне
     """
     bot = message.bot
     user = message.from_user.id
-    code = message.text + "\n"
+    source = message.text + "\n"
 
-    if not (10 <= len(code) <= 10 ** 4):
+    if not is_valid_source(message.text):
         await message.reply("Код должен содержать от 10 до 10⁴ символов!")
         return
 
     group, variant, task = manager.dialog_data["group"], manager.dialog_data["variant"], manager.dialog_data["task"]
-    user_session: ClientSession = manager.start_data["session"].session
+    db: UserStore = manager.middleware_data["db"]
+    user_data = await db.get(user)
+    if user_data is None or user_data.authorized is False:
+        await message.reply("Для этого авторизуйтесь через /auth")
+        return
+    if kispython_breaker.state is BreakerState.OPEN:
+        await message.reply(AuthStatus.SERVER_UNAVAILABLE.get_message())
+        return
+    cookie_jar: CookieJar = user_data.cookie_jar
 
     link = f"https://kispython.ru/group/{group}/variant/{int(variant) - 1}/task/{task}"
 
-    async with user_session.get(link) as page:
-        if page.status != 200:
-            await message.reply("Произошла ошибка")
-            return
-        content = await page.read()
-        parse = BeautifulSoup(content, "html.parser")
-        csrf_tag = parse.find(name="input", attrs={"name": "csrf_token"})
-        token = csrf_tag["value"]
-
-    code, status = await format_code(code)
-    if status == 200:
-        await bot.send_message(user, "Ваш код был отформатирован в соответствии с требованиями pep-8")
-        await bot.send_message(user, f"Отформатированный код:```python\n{code}```", parse_mode="markdown")
-    elif status == 204:
-        await bot.send_message(user, "Ваш код соответствует формату pep-8, изменений не произведено")
-    elif status == 400:
-        await bot.send_message(user, "Ваш код содержит синтаксические ошибки, отправка решения отменена")
+    # Места в kispython_gate и black_gate заняты только на время обращений к сервисам,
+    # ожидание результата проверки ограничено планировщиком проверок
+    try:
+        with kispython_gate.hold():
+            with black_gate.hold():
+                token = user_data.csrf_token
+                if token is None:
+                    token, (code, status) = await asyncio.gather(fetch_submit_token(cookie_jar, link),
+                                                                 format_code(source))
+                    user_data.csrf_token = token
+                    cached_token = False
+                else:
+                    code, status = await format_code(source)
+                    cached_token = True
+            text, parse_mode = format_notice(code, status)
+            if status == 400:
+                await bot.send_message(user, text)
+                return
+            if token is None:
+                await message.reply(error_text())
+                return
+            if code is None:
+                code = source
+            notice = send_in_background(bot.send_message(user, text, parse_mode=parse_mode))
+
+            page_status = await post_solution(cookie_jar, link, code, token)
+            if page_status == 400 and cached_token:
+                logger.info("csrf_token отклонён, повторная отправка")
+                user_data.csrf_token = token = await fetch_submit_token(cookie_jar, link)
+                if token is not None:
+                    page_status = await post_solution(cookie_jar, link, code, token)
+    except GateBusy as E:
+        submit_limiter.refund(user)
+        await message.reply(busy_text(E.gate))
         return
-    else:
-        await bot.send_message(user,
-                               "Произошла внутренняя ошибка. Проверка на соответствие формату pep-8 не выполнена")
-
-    data = {
-        "code": code,
-        "csrf_token": token
-    }
-    async with user_session.post(link, data=data) as page:
-        if page.status != 200:
-            await message.reply("Произошла ошибка")
-            return
+    if page_status != 200:
+        user_data.csrf_token = None
+        await asyncio.gather(notice, return_exceptions=True)
+        await message.reply(error_text())
+        return
+    user_data.passes += 1
+    db.mark_dirty(user)
+    logger.info(f"Решение отправлено, попытка {user_data.passes}")
 
-    await bot.send_chat_action(message.chat.id, "typing")
-    status, error = await expect_verdict(user_session, link)
+    send_in_background(bot.send_chat_action(message.chat.id, "typing"))
+    status, error = await expect_verdict(cookie_jar, link, user_data)
 
+    # Результат проверки отправляется после уведомления о форматировании
+    await asyncio.gather(notice, return_exceptions=True)
+    if error and len(status) + len(error) < 4000:
+        await bot.send_message(user, f"{status}\n{error}")
+        return
     await bot.send_message(user, status)
     if error:
         await bot.send_message(user, error)
@@ -294,25 +575,26 @@ async def solve_handler(
 
 group = Window(
     Const("Выберите группу"),
-    ScrollingGroup(
+    CachedScrollingGroup(
         Column(
             Select(
                 Format("{item}"),
                 items="groups",
                 id="groups",
-                item_id_getter=lambda x: groups.index(x),
+                item_id_getter=catalog.group_id,
                 on_click=on_group_selected
             ),
         ),
         id="groups_a",
         width=1,
-        height=10
+        height=10,
+        version_getter=lambda: catalog.version
     ),
     state=CodeStates.group
 )
 task = Window(
     Const("Выберите номер задачи"),
-    ScrollingGroup(
+    CachedScrollingGroup(
         Column(
             Select(
                 Format("{item}"),
@@ -324,7 +606,8 @@ task = Window(
         ),
         id="tasks_a",
         width=3,
-        height=4
+        height=4,
+        version_getter=lambda: catalog.version
     ),
     Back(text=Const("Назад")),
     state=CodeStates.task
@@ -332,7 +615,7 @@ task = Window(
 
 variant = Window(
     Const("Выберите Ваш вариант"),
-    ScrollingGroup(
+    CachedScrollingGroup(
         Column(
             Select(
                 Format("{item}"),
@@ -344,7 +627,8 @@ variant = Window(
         ),
         id="variants_a",
         width=5,
-        height=8
+        height=8,
+        version_getter=lambda: catalog.version
     ),
     Back(text=Const("Назад")),
     state=CodeStates.variant
@@ -366,15 +650,24 @@ code_router.message.outer_middleware(AuthMiddleware())
 # Далее можно считать, что работа идёт только с авторизованными
 
 @code_router.message(or_f(Command("code"), F.text == "code"))
-async def code_handler(message: Message, db: Dict[int, UserData], state: FSMContext, dialog_manager: DialogManager):
+async def code_handler(message: Message, db: UserStore, state: FSMContext, dialog_manager: DialogManager):
     """
     Обработчик команды code, входит в конечный автомат CodeStates
     """
     logger.info(f"Команда code")
 
-    await dialog_manager.start(CodeStates.group, mode=StartMode.RESET_STACK,
-                               data={"session": db.get(message.from_user.id, None)})
+    await dialog_manager.start(CodeStates.group, mode=StartMode.RESET_STACK)
 
 
 dialog = Dialog(group, task, variant, task_display,
                 getter=get_primary_data)
+
+# Отправка решения начинается только с действительной сессией
+dialog.message.middleware(AuthMiddleware())
+# Токен тратится только на решения допустимой длины в окне отправки (solve_handler)
+dialog.message.middleware(AdmissionMiddleware(submit_limiter, when=is_submission))
+# Из нажатий кнопок условие загружает только выбор задачи (on_task_selected)
+dialog.callback_query.middleware(AdmissionMiddleware(
+    condition_limiter,
+    when=lambda callback, data: remove_indent_id(callback.data)[1].startswith("tasks:")
+))
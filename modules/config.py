@@ -0,0 +1,164 @@
+import os
+
+from dotenv import load_dotenv
+
+
+load_dotenv("./.env")
+
+
+def get_int(name: str, default: int) -> int:
+    """
+    Возвращает целочисленное значение переменной окружения
+
+    :param name: имя переменной окружения
+    :type name: str
+    :param default: значение по умолчанию
+    :type default: int
+    :return: значение переменной
+    :rtype: int
+    """
+    value = os.getenv(name)
+    return default if value is None or value == "" else int(value)
+
+
+def get_float(name: str, default: float) -> float:
+    """
+    Возвращает вещественное значение переменной окружения
+
+    :param name: имя переменной окружения
+    :type name: str
+    :param default: значение по умолчанию
+    :type default: float
+    :return: значение переменной
+    :rtype: float
+    """
+    value = os.getenv(name)
+    return default if value is None or value == "" else float(value)
+
+
+#: Количество решений, которые пользователь может отправить подряд, 0 - без ограничения
+ADMISSION_SUBMIT_BURST = get_int("ADMISSION_SUBMIT_BURST", 3)
+#: Время восстановления одной отправки решения, в секундах
+ADMISSION_SUBMIT_INTERVAL = get_float("ADMISSION_SUBMIT_INTERVAL", 20)
+#: Количество условий, которые пользователь может запросить подряд, 0 - без ограничения
+ADMISSION_CONDITION_BURST = get_int("ADMISSION_CONDITION_BURST", 5)
+#: Время восстановления одного запроса условия, в секундах
+ADMISSION_CONDITION_INTERVAL = get_float("ADMISSION_CONDITION_INTERVAL", 6)
+#: Максимальное количество одновременно обрабатываемых действий с обращением к kispython, 0 - без ограничения
+ADMISSION_KISPYTHON_LIMIT = get_int("ADMISSION_KISPYTHON_LIMIT", 100)
+#: Максимальное количество одновременно обрабатываемых отправок решений с форматированием black, 0 - без ограничения
+ADMISSION_BLACK_LIMIT = get_int("ADMISSION_BLACK_LIMIT", 50)
+#: Время, через которое предлагается повторить действие при перегрузке сервиса, в секундах
+ADMISSION_RETRY_AFTER = get_int("ADMISSION_RETRY_AFTER", 5)
+#: Способ получения обновлений: polling или webhook
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+#: Период обновления списка групп и задач, в секундах
+CATALOG_TTL = get_int("CATALOG_TTL", 6 * 60 * 60)
+#: Максимальное количество страниц с условиями в кэше
+CONDITION_CACHE_SIZE = get_int("CONDITION_CACHE_SIZE", 256)
+#: Время жизни страницы с условиями в кэше, в секундах
+CONDITION_CACHE_TTL = get_int("CONDITION_CACHE_TTL", 60 * 60)
+#: Загружать страницу с условиями потоково, только до следующего варианта (0 или 1)
+CONDITION_STREAMING = get_int("CONDITION_STREAMING", 0)
+#: Размер части страницы при потоковой загрузке, в байтах
+CONDITION_STREAM_CHUNK = get_int("CONDITION_STREAM_CHUNK", 8 * 1024)
+#: Заранее загружать страницы с условиями всех задач всех групп (0 или 1)
+CONDITION_WARMER = get_int("CONDITION_WARMER", 0)
+#: Количество одновременных загрузок страниц с условиями в фоне
+CONDITION_WARMER_CONCURRENCY = get_int("CONDITION_WARMER_CONCURRENCY", 4)
+#: Период проверки актуальности загруженных страниц, в секундах
+CONDITION_WARMER_INTERVAL = get_int("CONDITION_WARMER_INTERVAL", 15 * 60)
+#: Максимальное количество file_id отправленных условий в кэше
+FILE_ID_CACHE_SIZE = get_int("FILE_ID_CACHE_SIZE", 16384)
+#: Способ форматирования кода: http (black сервер) или process (пул процессов)
+FORMATTER = os.getenv("FORMATTER", "http")
+#: Адрес black сервера
+BLACK_URL = os.getenv("BLACK_URL", "http://black:9090")
+#: Количество процессов форматирования
+FORMATTER_WORKERS = get_int("FORMATTER_WORKERS", 2)
+#: Максимальное количество результатов форматирования в кэше
+FORMAT_CACHE_SIZE = get_int("FORMAT_CACHE_SIZE", 4096)
+#: Количество неудачных запросов подряд, после которого сервис считается недоступным
+BREAKER_FAILURES = get_int("BREAKER_FAILURES", 5)
+#: Время, в течение которого запросы к недоступному сервису сразу отклоняются, в секундах
+BREAKER_RESET_TIMEOUT = get_float("BREAKER_RESET_TIMEOUT", 30)
+#: Таймаут установки соединения с kispython и ЛКС, в секундах
+KISPYTHON_CONNECT_TIMEOUT = get_float("KISPYTHON_CONNECT_TIMEOUT", 5)
+#: Таймаут чтения ответа kispython и ЛКС, в секундах
+KISPYTHON_READ_TIMEOUT = get_float("KISPYTHON_READ_TIMEOUT", 20)
+#: Таймаут установки соединения с black сервером, в секундах
+BLACK_CONNECT_TIMEOUT = get_float("BLACK_CONNECT_TIMEOUT", 2)
+#: Таймаут чтения ответа black сервера, в секундах
+BLACK_READ_TIMEOUT = get_float("BLACK_READ_TIMEOUT", 10)
+#: Максимальное количество одновременных запросов к kispython, меньше HTTP_POOL_LIMIT_PER_HOST
+KISPYTHON_CONCURRENCY = get_int("KISPYTHON_CONCURRENCY", 24)
+#: Максимальное количество соединений в общем пуле HTTP клиента
+HTTP_POOL_LIMIT = get_int("HTTP_POOL_LIMIT", 100)
+#: Максимальное количество соединений к одному хосту
+HTTP_POOL_LIMIT_PER_HOST = get_int("HTTP_POOL_LIMIT_PER_HOST", 30)
+#: Время хранения ответов DNS, в секундах
+HTTP_DNS_TTL = get_int("HTTP_DNS_TTL", 10 * 60)
+#: Время удержания неактивного keep-alive соединения, в секундах
+HTTP_KEEPALIVE_TIMEOUT = get_int("HTTP_KEEPALIVE_TIMEOUT", 60)
+#: Количество заранее подготовленных к авторизации сессий, 0 - готовить при вводе пароля
+LOGIN_POOL_SIZE = get_int("LOGIN_POOL_SIZE", 2)
+#: Время, в течение которого подготовленная сессия считается свежей, в секундах
+LOGIN_POOL_TTL = get_int("LOGIN_POOL_TTL", 10 * 60)
+#: Период проверки сессии пользователя перед обработкой команд, в секундах, 0 - не проверять
+SESSION_PROBE_INTERVAL = get_int("SESSION_PROBE_INTERVAL", 5 * 60)
+#: Страница kispython, доступная только авторизованному пользователю, для проверки сессии
+SESSION_PROBE_URL = os.getenv("SESSION_PROBE_URL", "https://kispython.ru/group/0/variant/0/task/0")
+#: Фоновая проверка и продление сессий активных пользователей (0 или 1)
+SESSION_KEEPALIVE = get_int("SESSION_KEEPALIVE", 0)
+#: Период фоновой проверки сессий, в секундах
+SESSION_KEEPALIVE_INTERVAL = get_int("SESSION_KEEPALIVE_INTERVAL", 10 * 60)
+#: Окно активности, в течение которого сессия пользователя продлевается, в секундах
+SESSION_KEEPALIVE_WINDOW = get_int("SESSION_KEEPALIVE_WINDOW", 2 * 60 * 60)
+#: Хранилище состояний диалогов (FSM): memory, redis или sqlite
+FSM_STORAGE = os.getenv("FSM_STORAGE", "memory")
+#: Путь к файлу базы данных SQLite для состояний диалогов
+FSM_STORAGE_PATH = os.getenv("FSM_STORAGE_PATH", "data/fsm.sqlite3")
+#: Адрес Redis для FSM_STORAGE=redis и USER_STORE=redis
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+#: Постоянное хранилище данных пользователей: memory, sqlite или redis
+USER_STORE = os.getenv("USER_STORE", "memory")
+#: Путь к файлу базы данных SQLite
+USER_STORE_PATH = os.getenv("USER_STORE_PATH", "data/users.sqlite3")
+#: Период сброса изменений данных пользователей в хранилище, в секундах
+USER_STORE_FLUSH_INTERVAL = get_int("USER_STORE_FLUSH_INTERVAL", 5)
+#: Максимальное количество пользователей в кэше
+USER_CACHE_SIZE = get_int("USER_CACHE_SIZE", 10000)
+#: Время без обращений, после которого пользователь вытесняется из кэша, в секундах
+USER_IDLE_TIMEOUT = get_int("USER_IDLE_TIMEOUT", 24 * 60 * 60)
+#: Максимальное количество одновременных запросов проверки решений
+VERDICT_MAX_POLLS = get_int("VERDICT_MAX_POLLS", 20)
+#: Задержка перед первой проверкой решения, в секундах
+VERDICT_FIRST_DELAY = get_float("VERDICT_FIRST_DELAY", 1)
+#: Максимальная задержка между проверками решения, в секундах
+VERDICT_MAX_DELAY = get_float("VERDICT_MAX_DELAY", 8)
+#: Максимальное время ожидания результата проверки, в секундах
+VERDICT_TIMEOUT = get_float("VERDICT_TIMEOUT", 30)
+#: Пул разбора html: thread или process
+PARSE_EXECUTOR = os.getenv("PARSE_EXECUTOR", "thread")
+#: Размер пула разбора html
+PARSE_WORKERS = get_int("PARSE_WORKERS", 4)
+#: Размер страницы в байтах, до которого разбор выполняется в цикле событий
+PARSE_INLINE_THRESHOLD = get_int("PARSE_INLINE_THRESHOLD", 16 * 1024)
+#: Внешний адрес бота для регистрации webhook в Telegram, пусто - не регистрировать
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+#: Путь, по которому принимаются обновления
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+#: Адрес, на котором слушает webhook сервер
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+#: Порт webhook сервера
+WEBHOOK_PORT = get_int("WEBHOOK_PORT", 8080)
+#: Секрет заголовка X-Telegram-Bot-Api-Secret-Token, пусто - не проверять
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+#: Максимальное количество одновременно обрабатываемых обновлений
+WEBHOOK_CONCURRENCY = get_int("WEBHOOK_CONCURRENCY", 200)
+#: Максимальное количество одновременных соединений Telegram к webhook
+WEBHOOK_MAX_CONNECTIONS = get_int("WEBHOOK_MAX_CONNECTIONS", 40)
+#: Адреса всех процессов бота через запятую (например http://bot-0:8080,http://bot-1:8080), пусто - один процесс
+WORKER_URLS = os.getenv("WORKER_URLS", "")
+#: Номер этого процесса в WORKER_URLS
+WORKER_ID = get_int("WORKER_ID", 0)
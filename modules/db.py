@@ -1,13 +1,458 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
 from dataclasses import dataclass
-from aiohttp import ClientSession
+from http.cookies import SimpleCookie
+from logging import getLogger
+from typing import Any, Dict, List, Set, Tuple, Union
 
+from aiohttp import CookieJar
+from yarl import URL
 
-@dataclass
+from . import config
+
+
+logger = getLogger(__name__)
+
+#: Атрибуты cookie, которые сохраняются в постоянном хранилище
+COOKIE_ATTRS = ("domain", "path", "expires", "secure", "httponly", "samesite")
+
+
+@dataclass(slots=True)
 class UserData:
     """
     Объект данных, связанных с пользователем в кэше
     """
     authorized: bool #: Авторизован ли пользователь
     passes: int #: Кол-во попыток решения задачи
-    session: ClientSession #: Объект сессии с токенами для авторизации
+    cookie_jar: CookieJar #: Cookie с токенами для авторизации
     session_data: dict #: Данные для авторизации (передаётся в login_via_lks)
+    csrf_token: Union[str, None] = None #: Последний известный csrf_token формы отправки решения
+    validated: float = 0 #: Время последней успешной проверки сессии, time.monotonic()
+
+
+def dump_user(user_data: UserData) -> Dict[str, Any]:
+    """
+    Сериализует данные пользователя вместе с cookie в словарь для хранилища
+
+    :param user_data: данные пользователя
+    :type user_data: UserData
+    :return: словарь, пригодный для json
+    :rtype: Dict[str, Any]
+    """
+    cookie_jar = user_data.cookie_jar
+    cookies = []
+    for morsel in cookie_jar:
+        cookie = {"name": morsel.key, "value": morsel.value}
+        cookie.update((attr, morsel[attr]) for attr in COOKIE_ATTRS if morsel[attr])
+        # CookieJar подставляет домен ответа и в host-only cookie, флаг хранится отдельно
+        if (morsel["domain"], morsel.key) in cookie_jar._host_only_cookies:
+            cookie["host_only"] = True
+        # Max-Age относителен, поэтому сохраняется абсолютный момент истечения
+        expires_at = cookie_jar._expirations.get((morsel["domain"], morsel["path"], morsel.key))
+        if morsel["max-age"] and expires_at is not None:
+            cookie["expires_at"] = expires_at
+        cookies.append(cookie)
+    return {
+        "authorized": user_data.authorized,
+        "passes": user_data.passes,
+        "session_data": user_data.session_data,
+        "csrf_token": user_data.csrf_token,
+        "cookies": cookies,
+    }
+
+
+def load_user(row: Dict[str, Any]) -> UserData:
+    """
+    Восстанавливает данные пользователя и его cookie из словаря хранилища,
+    должна вызываться внутри цикла событий
+
+    :param row: словарь, возвращённый dump_user
+    :type row: Dict[str, Any]
+    :return: данные пользователя
+    :rtype: UserData
+    """
+    cookie_jar = CookieJar()
+    now = time.time()
+    for cookie in row["cookies"]:
+        morsel = SimpleCookie()
+        morsel[cookie["name"]] = cookie["value"]
+        for attr in COOKIE_ATTRS:
+            if attr in cookie:
+                morsel[cookie["name"]][attr] = cookie[attr]
+        if "expires_at" in cookie:
+            max_age = int(cookie["expires_at"] - now)
+            if max_age <= 0:
+                continue
+            morsel[cookie["name"]]["max-age"] = str(max_age)
+        domain = cookie.get("domain", "").lstrip(".")
+        if cookie.get("host_only"):
+            # Без атрибута domain CookieJar снова пометит cookie как host-only
+            morsel[cookie["name"]]["domain"] = ""
+        cookie_jar.update_cookies(morsel, URL(f"https://{domain}/") if domain else URL())
+    return UserData(row["authorized"], row["passes"], cookie_jar, row["session_data"], row.get("csrf_token"))
+
+
+def connect_sqlite(path: str, schema: str) -> sqlite3.Connection:
+    """
+    Открывает файл SQLite, общий для нескольких процессов бота, и создаёт таблицу
+
+    :param path: путь к файлу базы данных
+    :type path: str
+    :param schema: запрос CREATE TABLE IF NOT EXISTS
+    :type schema: str
+    :return: соединение, пригодное для использования из разных потоков под блокировкой
+    :rtype: sqlite3.Connection
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    connection = sqlite3.connect(path, check_same_thread=False, timeout=30)
+    # Файл может использоваться несколькими процессами бота
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute(schema)
+    connection.commit()
+    return connection
+
+
+class MemoryBackend:
+    """
+    Хранилище без сохранения, данные живут только в памяти процесса
+    """
+    async def load(self, user_id: int) -> Union[Dict[str, Any], None]:
+        return None
+
+    async def save(self, rows: Dict[int, Union[Dict[str, Any], None]]):
+        pass
+
+    async def close(self):
+        pass
+
+
+class SQLiteBackend:
+    """
+    Постоянное хранилище данных пользователей в SQLite
+
+    Запросы выполняются в отдельном потоке, чтобы не блокировать цикл событий
+
+    :param path: путь к файлу базы данных
+    :type path: str
+    """
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self._connection = connect_sqlite(
+            path, "CREATE TABLE IF NOT EXISTS users (user_id INTEGER PRIMARY KEY, data TEXT NOT NULL)")
+
+    def _load(self, user_id: int) -> Union[Dict[str, Any], None]:
+        with self._lock:
+            row = self._connection.execute("SELECT data FROM users WHERE user_id = ?", (user_id,)).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def _save(self, rows: Dict[int, Union[Dict[str, Any], None]]):
+        updated = [(user_id, json.dumps(row)) for user_id, row in rows.items() if row is not None]
+        deleted = [(user_id,) for user_id, row in rows.items() if row is None]
+        with self._lock, self._connection:
+            self._connection.executemany("INSERT OR REPLACE INTO users (user_id, data) VALUES (?, ?)", updated)
+            self._connection.executemany("DELETE FROM users WHERE user_id = ?", deleted)
+
+    async def load(self, user_id: int) -> Union[Dict[str, Any], None]:
+        """
+        Возвращает сохранённые данные пользователя или None
+
+        :param user_id: id пользователя
+        :type user_id: int
+        :return: словарь, возвращённый dump_user
+        :rtype: Union[Dict[str, Any], None]
+        """
+        return await asyncio.to_thread(self._load, user_id)
+
+    async def save(self, rows: Dict[int, Union[Dict[str, Any], None]]):
+        """
+        Сохраняет пачку изменений одной транзакцией, None означает удаление
+
+        :param rows: словарь id пользователя -> данные или None
+        :type rows: Dict[int, Union[Dict[str, Any], None]]
+        """
+        if rows:
+            await asyncio.to_thread(self._save, rows)
+
+    async def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+class RedisBackend:
+    """
+    Постоянное хранилище данных пользователей в Redis (или совместимом сервере),
+    общее для нескольких процессов и машин
+
+    :param url: адрес сервера, например redis://localhost:6379/0
+    :type url: str
+    :param prefix: префикс ключей
+    :type prefix: str
+    """
+    def __init__(self, url: str, prefix: str = "kispython:user:"):
+        # redis - необязательная зависимость, нужна только для этого хранилища
+        from redis.asyncio import Redis
+        self._redis = Redis.from_url(url)
+        self._prefix = prefix
+
+    async def load(self, user_id: int) -> Union[Dict[str, Any], None]:
+        """
+        Возвращает сохранённые данные пользователя или None
+
+        :param user_id: id пользователя
+        :type user_id: int
+        :return: словарь, возвращённый dump_user
+        :rtype: Union[Dict[str, Any], None]
+        """
+        row = await self._redis.get(f"{self._prefix}{user_id}")
+        return None if row is None else json.loads(row)
+
+    async def save(self, rows: Dict[int, Union[Dict[str, Any], None]]):
+        """
+        Сохраняет пачку изменений одной транзакцией, None означает удаление
+
+        :param rows: словарь id пользователя -> данные или None
+        :type rows: Dict[int, Union[Dict[str, Any], None]]
+        """
+        if not rows:
+            return
+        async with self._redis.pipeline(transaction=True) as pipe:
+            for user_id, row in rows.items():
+                if row is None:
+                    pipe.delete(f"{self._prefix}{user_id}")
+                else:
+                    pipe.set(f"{self._prefix}{user_id}", json.dumps(row))
+            await pipe.execute()
+
+    async def close(self):
+        await self._redis.aclose()
+
+
+def create_backend(kind: str):
+    """
+    Создаёт постоянное хранилище данных пользователей
+
+    :param kind: тип хранилища: memory, sqlite или redis
+    :type kind: str
+    :return: MemoryBackend, SQLiteBackend или RedisBackend
+    """
+    if kind == "sqlite":
+        return SQLiteBackend(config.USER_STORE_PATH)
+    if kind == "redis":
+        return RedisBackend(config.REDIS_URL)
+    return MemoryBackend()
+
+
+class UserStore:
+    """
+    Хранилище данных пользователей: кэш в памяти и постоянный backend
+    с отложенной записью (write-behind)
+
+    Изменения копятся в буфере и сбрасываются в backend раз в flush_interval секунд,
+    после перезапуска данные пользователя восстанавливаются при первом обращении.
+    Кэш ограничен max_entries записями (LRU), записи без обращений дольше
+    idle_timeout секунд вытесняются. Вытесненный пользователь восстанавливается
+    из backend, а без постоянного хранилища должен пройти /auth заново
+
+    :param backend: постоянное хранилище, по умолчанию MemoryBackend
+    :param flush_interval: период сброса буфера, в секундах
+    :type flush_interval: float
+    :param max_entries: максимальное количество пользователей в кэше
+    :type max_entries: int
+    :param idle_timeout: время без обращений до вытеснения, в секундах
+    :type idle_timeout: float
+    """
+    def __init__(self, backend=None, flush_interval: float = 5,
+                 max_entries: int = 10000, idle_timeout: float = 24 * 60 * 60):
+        self.hits = 0 #: Кол-во обращений, найденных в кэше
+        self.misses = 0 #: Кол-во обращений мимо кэша
+        self.evictions = 0 #: Кол-во вытесненных записей
+        self._backend = backend or MemoryBackend()
+        self._flush_interval = flush_interval
+        self._max_entries = max_entries
+        self._idle_timeout = idle_timeout
+        # user_id -> данные, от давних обращений к недавним
+        self._cache: OrderedDict[int, UserData] = OrderedDict()
+        self._last_access: Dict[int, float] = {}
+        self._dirty: Set[int] = set()
+        # Строки, ожидающие записи: вытесненные (dump_user) и удалённые (None)
+        self._pending: Dict[int, Union[Dict[str, Any], None]] = {}
+        self._flush_task: Union[asyncio.Task, None] = None
+
+    async def start(self):
+        """
+        Запускает фоновый сброс буфера изменений и вытеснение неактивных записей
+        """
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_loop())
+
+    def _touch(self, user_id: int):
+        self._cache.move_to_end(user_id)
+        self._last_access[user_id] = time.monotonic()
+
+    def _put(self, user_id: int, user_data: UserData):
+        self._cache[user_id] = user_data
+        self._touch(user_id)
+        while len(self._cache) > self._max_entries:
+            self._evict(next(iter(self._cache)))
+
+    def _evict(self, user_id: int):
+        user_data = self._cache.pop(user_id)
+        self._last_access.pop(user_id, None)
+        if user_id in self._dirty:
+            self._dirty.discard(user_id)
+            self._pending[user_id] = dump_user(user_data)
+        self.evictions += 1
+
+    def evict_idle(self) -> int:
+        """
+        Вытесняет записи без обращений дольше idle_timeout
+
+        :return: количество вытесненных записей
+        :rtype: int
+        """
+        deadline = time.monotonic() - self._idle_timeout
+        idle = []
+        for user_id in self._cache:  # от давних обращений к недавним
+            if self._last_access[user_id] > deadline:
+                break
+            idle.append(user_id)
+        for user_id in idle:
+            self._evict(user_id)
+        return len(idle)
+
+    async def get(self, user_id: int) -> Union[UserData, None]:
+        """
+        Возвращает данные пользователя, при необходимости восстанавливая их из backend
+
+        :param user_id: id пользователя
+        :type user_id: int
+        :return: данные пользователя или None
+        :rtype: Union[UserData, None]
+        """
+        user_data = self._cache.get(user_id)
+        if user_data is not None:
+            self.hits += 1
+            self._touch(user_id)
+            return user_data
+        self.misses += 1
+        if user_id in self._pending:
+            row = self._pending[user_id]
+        else:
+            row = await self._backend.load(user_id)
+        if row is None:
+            return None
+        # Пока шла загрузка, данные могли быть записаны заново
+        user_data = self._cache.get(user_id)
+        if user_data is None:
+            user_data = load_user(row)
+            logger.info("Данные пользователя восстановлены из хранилища")
+        self._put(user_id, user_data)
+        return user_data
+
+    async def set(self, user_id: int, user_data: UserData):
+        """
+        Сохраняет данные пользователя
+
+        :param user_id: id пользователя
+        :type user_id: int
+        :param user_data: данные пользователя
+        :type user_data: UserData
+        """
+        self._pending.pop(user_id, None)
+        self._put(user_id, user_data)
+        self._dirty.add(user_id)
+
+    def mark_dirty(self, user_id: int):
+        """
+        Помечает данные пользователя (например, обновлённые cookie) для записи в backend
+
+        :param user_id: id пользователя
+        :type user_id: int
+        """
+        if user_id in self._cache:
+            self._dirty.add(user_id)
+
+    async def delete(self, user_id: int):
+        """
+        Удаляет данные пользователя
+
+        :param user_id: id пользователя
+        :type user_id: int
+        """
+        self._cache.pop(user_id, None)
+        self._last_access.pop(user_id, None)
+        self._dirty.discard(user_id)
+        self._pending[user_id] = None
+
+    def recent(self, window: float) -> List[Tuple[int, UserData]]:
+        """
+        Возвращает пользователей в кэше, обращавшихся не раньше window секунд назад
+
+        :param window: окно активности, в секундах
+        :type window: float
+        :return: список пар id пользователя, данные
+        :rtype: List[Tuple[int, UserData]]
+        """
+        deadline = time.monotonic() - window
+        active = []
+        for user_id in reversed(self._cache):  # от недавних обращений к давним
+            if self._last_access[user_id] < deadline:
+                break
+            active.append((user_id, self._cache[user_id]))
+        return active
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Возвращает размер кэша и счётчики обращений
+
+        :return: словарь size, hits, misses, evictions
+        :rtype: Dict[str, int]
+        """
+        return {"size": len(self._cache), "hits": self.hits,
+                "misses": self.misses, "evictions": self.evictions}
+
+    async def flush(self):
+        """
+        Сбрасывает накопленные изменения в backend
+        """
+        rows = self._pending
+        rows.update((user_id, dump_user(self._cache[user_id])) for user_id in self._dirty)
+        self._pending = {}
+        self._dirty.clear()
+        try:
+            await self._backend.save(rows)
+        except Exception:
+            # Изменения вернутся в буфер и будут записаны при следующем сбросе
+            for user_id, row in rows.items():
+                if user_id in self._cache:
+                    self._dirty.add(user_id)
+                else:
+                    self._pending.setdefault(user_id, row)
+            raise
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self._flush_interval)
+            if evicted := self.evict_idle():
+                logger.info(f"Вытеснено неактивных пользователей: {evicted}, {self.stats()}")
+            try:
+                await self.flush()
+            except Exception as E:
+                logger.error(f"Не удалось сохранить данные пользователей {E}")
+
+    async def close(self):
+        """
+        Останавливает фоновый сброс, записывает оставшиеся изменения и закрывает backend
+        """
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        await self.flush()
+        await self._backend.close()
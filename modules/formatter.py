@@ -0,0 +1,156 @@
+import asyncio
+import importlib.util
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from logging import getLogger
+from typing import Tuple, Union
+
+from aiohttp import ClientConnectionError
+
+from . import config
+from .breaker import black_breaker
+from .cache import format_cache
+from .client import client_pool
+
+
+logger = getLogger(__name__)
+
+
+def black_format(code: str) -> Tuple[Union[str, None], int]:
+    """
+    Форматирует код библиотекой black, выполняется в отдельном процессе
+
+    Возвращает те же статусы, что и black сервер, см. format_code
+
+    :param code: код программы
+    :type code: str
+    :return: отформатировнный код программы и статус
+    :rtype: Tuple[Union[str, None], int]
+    """
+    try:
+        import black
+    except ImportError:
+        logger.error("Пакет black не установлен, форматирование невозможно")
+        return code, 500
+    try:
+        formatted = black.format_str(code, mode=black.Mode())
+    except black.InvalidInput:
+        return code, 400
+    except Exception:
+        return code, 500
+    if formatted == code:
+        return code, 204
+    return formatted, 200
+
+
+class HttpFormatter:
+    """
+    Форматирование через отдельный black сервер (blackd)
+
+    :param url: адрес black сервера
+    :type url: str
+    """
+    def __init__(self, url: str):
+        self._url = url
+
+    async def format(self, code: str) -> Tuple[Union[str, None], int]:
+        """
+        Отправляет код на форматирование к black серверу, см. format_code
+
+        :param code: код программы
+        :type code: str
+        :return: отформатировнный код программы и статус
+        :rtype: Tuple[Union[str, None], int]
+        """
+        try:
+            logger.debug('Отправка кода на форматирование к black серверу')
+            async with black_breaker.guard() as call, \
+                    client_pool.session.post(self._url, data=code.encode('utf-8'), timeout=black_breaker.timeout) as response:
+                logger.debug('Ответ от black %s', response.status)
+                call.check(response.status)
+                if response.status == 200:
+                    text = await response.text('utf-8')
+                    return text, response.status
+                else:
+                    return code, response.status
+        except ClientConnectionError as E:
+            logger.error(f'Не удалось подключиться к black серверу, {E}')
+            return None, 404
+
+    async def close(self):
+        pass
+
+
+class ProcessFormatter:
+    """
+    Форматирование библиотекой black в пуле процессов текущего контейнера
+
+    Убирает сетевой запрос из отправки решения и не нагружает цикл событий
+
+    :param workers: количество процессов
+    :type workers: int
+    :raises RuntimeError: пакет black не установлен
+    """
+    def __init__(self, workers: int):
+        # Без black каждое решение отправлялось бы неотформатированным, лучше не запускаться
+        if importlib.util.find_spec("black") is None:
+            raise RuntimeError("FORMATTER=process требует пакет black: python -m pip install black")
+        self._workers = workers
+        self._executor: Union[ProcessPoolExecutor, None] = None
+
+    async def format(self, code: str) -> Tuple[Union[str, None], int]:
+        """
+        Форматирует код в пуле процессов, см. format_code
+
+        :param code: код программы
+        :type code: str
+        :return: отформатировнный код программы и статус
+        :rtype: Tuple[Union[str, None], int]
+        """
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self._workers)
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, black_format, code)
+        except BrokenProcessPool as E:
+            logger.error(f'Пул процессов форматирования недоступен, {E}')
+            self._executor = None
+            return code, 500
+
+    async def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+async def format_code(code: str) -> Tuple[Union[str, None], int]:
+    """
+    Форматирует python-код в соответствии с PEP-8
+
+    Возвращает отформатированный код и статус ответа:
+
+    * Статус 200, код был отформатирован возвращает код
+    * Статус 204, код был в соответствии с PEP-8 возвращает исходный код
+    * Статус 400, синтаксическая ошибка возвращает None
+    * Статус 500, иная ошибка (сервера) возвращает исходный код
+
+    Повторная отправка того же кода берёт результат из format_cache,
+    способ форматирования задаётся переменной окружения FORMATTER
+
+    :param code: код программы
+    :type code: str
+    :return: отформатировнный код программы или None
+    :rtype: Tuple[Union[str, None], int]
+    """
+
+    if (result := format_cache.get(code)) is not None:
+        logger.debug('Результат форматирования взят из кэша')
+        return result
+    result = await formatter.format(code)
+    format_cache.set(code, result)
+    return result
+
+
+if config.FORMATTER == "process":
+    formatter = ProcessFormatter(config.FORMATTER_WORKERS)
+else:
+    formatter = HttpFormatter(config.BLACK_URL)
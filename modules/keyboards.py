@@ -0,0 +1,65 @@
+from typing import Callable, Dict, Hashable, Union
+
+from aiogram_dialog import DialogManager
+from aiogram_dialog.api.internal import RawKeyboard
+from aiogram_dialog.widgets.kbd import ScrollingGroup
+
+
+def copy_keyboard(keyboard: RawKeyboard) -> RawKeyboard:
+    """
+    Копирует клавиатуру вместе с кнопками
+
+    aiogram_dialog дописывает id диалога в callback_data кнопок при каждой отрисовке,
+    поэтому сохранённые кнопки нельзя отдавать без копирования
+
+    :param keyboard: клавиатура
+    :type keyboard: RawKeyboard
+    :return: копия клавиатуры
+    :rtype: RawKeyboard
+    """
+    return [[button.model_copy() for button in row] for row in keyboard]
+
+
+class CachedScrollingGroup(ScrollingGroup):
+    """
+    ScrollingGroup со статичным содержимым, клавиатура каждой страницы
+    строится один раз и затем только копируется
+
+    Содержимое не должно зависеть от пользователя: кэш общий для всех
+    и сбрасывается, когда меняется значение version_getter()
+
+    :param version_getter: функция, возвращающая версию данных клавиатуры
+    :type version_getter: Callable[[], Hashable]
+    """
+    def __init__(self, *buttons, version_getter: Callable[[], Hashable], **kwargs):
+        super().__init__(*buttons, **kwargs)
+        self.hits = 0 #: Кол-во отрисовок из кэша
+        self.misses = 0 #: Кол-во построенных клавиатур
+        self._version_getter = version_getter
+        self._version: Hashable = None
+        self._contents: Union[RawKeyboard, None] = None
+        self._pages: Dict[int, RawKeyboard] = {}
+
+    async def _get_contents(self, data: Dict, manager: DialogManager) -> RawKeyboard:
+        version = self._version_getter()
+        if self._contents is None or version != self._version:
+            self._contents = await self._render_contents(data, manager)
+            self._version = version
+            self._pages = {}
+        return self._contents
+
+    async def _render_keyboard(self, data: Dict, manager: DialogManager) -> RawKeyboard:
+        contents = await self._get_contents(data, manager)
+        pages = self._get_page_count(contents)
+        page = max(0, min(pages - 1, await self.get_page(manager)))
+        keyboard = self._pages.get(page)
+        if keyboard is None:
+            self.misses += 1
+            keyboard = await self._render_page(page, contents) + await self._render_pager(pages, manager)
+            self._pages[page] = keyboard
+        else:
+            self.hits += 1
+        return copy_keyboard(keyboard)
+
+    async def get_page_count(self, data: Dict, manager: DialogManager) -> int:
+        return self._get_page_count(await self._get_contents(data, manager))
@@ -1,13 +1,26 @@
+import asyncio
+import time
+from collections import deque
+from dataclasses import dataclass
 from enum import Enum
-from typing import Dict, Union
+from typing import Deque, Dict, Tuple, Union
 from logging import getLogger
 
-from aiohttp import ClientSession
+from aiohttp import ClientSession, CookieJar
 from aiohttp import ClientConnectionError
-from bs4 import BeautifulSoup
+
+from . import config
+from .breaker import lks_breaker
+from .client import client_pool
+from .db import UserData, UserStore
+from .outbound import Priority, kispython_scheduler
+from .parsing import parse_executor, extract_login_form, extract_login_error, count_tasks
+from .periodic import PeriodicTask
 
 
 AUTH_URL = "https://kispython.ru/login/lks"
+#: Статусы ответа, означающие, что сессия больше не авторизована
+EXPIRED_STATUSES = (301, 302, 303, 307, 308, 401, 403)
 logger = getLogger(__name__)
 
 
@@ -30,31 +43,29 @@ class AuthStatus(Enum):
         return self.value[1]
 
 
-async def prepare_session_for_login(session: ClientSession) -> AuthStatus:
+async def prepare_session_for_login(session: ClientSession, priority: Priority = Priority.CRITICAL) -> AuthStatus:
     """Подготавливает ссылки и csrf_token для будущей авторизации
 
     :param session: объект сессии
     :type session: ClientSession
+    :param priority: класс запроса в kispython_scheduler
+    :type priority: Priority
     :return: Cтатус ответа
     :rtype: AuthStatus
     """
     try:
-        async with session.get(AUTH_URL, headers={"Referer": "https://kispython.ru/"}) as page:
+        async with kispython_scheduler.slot(priority, lks_breaker) as call, \
+                session.get(AUTH_URL, headers={"Referer": "https://kispython.ru/"}) as page:
+            call.check(page.status)
             if page.status != 200:
                 return AuthStatus.SERVER_UNAVAILABLE, None
 
             content = await page.read()
             log_url = str(page.url)
-            parse = BeautifulSoup(content, "html.parser")
-            csrf_tag = parse.find(name="input", attrs={"name": "csrfmiddlewaretoken"})  # CSRF код
-            token = csrf_tag["value"]
-            next_tag = parse.find(name="input", attrs={"name": "next"})  # адрес следующего редиректа
-            next_url = next_tag["value"]
-            return AuthStatus.SUCCESS, {
-                "log_url": log_url,
-                "csrfmiddlewaretoken": token,
-                "next": next_url
-            }
+        form = await parse_executor.run(extract_login_form, content)
+        if form is None:
+            return AuthStatus.UNDEFINED_ERROR, None
+        return AuthStatus.SUCCESS, {"log_url": log_url, **form}
     except ClientConnectionError as E:
         logger.error(f"Нет доступа к kispython, сервер недоступен {E}")
         return AuthStatus.SERVER_UNAVAILABLE, None
@@ -80,21 +91,22 @@ async def login_via_lks(session: ClientSession, login: str, password: str, data:
     log_url = data.pop("log_url")
     logger.info("Авторизация через ЛКС...")
     try:
-        async with session.post(log_url, data=data, headers={"Referer": log_url}) as page:
+        async with kispython_scheduler.slot(Priority.CRITICAL, lks_breaker) as call, \
+                session.post(log_url, data=data, headers={"Referer": log_url}) as page:
+            call.check(page.status)
             logger.info(f"Авторизация через ЛКС, статус {page.status}")
             if page.status != 200:
                 return AuthStatus.SERVER_UNAVAILABLE
 
             content = await page.read()
-            parse = BeautifulSoup(content, "html.parser")
-            login_form = parse.find(id="mirea-users-loginform")
-            if login_form is not None and login_form.text.startswith("Указан неверный логин/пароль"):
-                return AuthStatus.INVALID_AUTH_DATA
-            elif login_form is not None and login_form.text.startswith("Превышено количество неудачных попыток входа"):
-                return AuthStatus.TOO_MANY_ATTEMPTS
-            elif login_form is not None:
-                return AuthStatus.UNDEFINED_ERROR
-            return AuthStatus.SUCCESS
+        login_form = await parse_executor.run(extract_login_error, content)
+        if login_form is not None and login_form.startswith("Указан неверный логин/пароль"):
+            return AuthStatus.INVALID_AUTH_DATA
+        elif login_form is not None and login_form.startswith("Превышено количество неудачных попыток входа"):
+            return AuthStatus.TOO_MANY_ATTEMPTS
+        elif login_form is not None:
+            return AuthStatus.UNDEFINED_ERROR
+        return AuthStatus.SUCCESS
     except ClientConnectionError as E:
         logger.error(f"Авторизация через ЛКС не сработала, сервер недоступен {E}")
         return AuthStatus.SERVER_UNAVAILABLE
@@ -111,16 +123,223 @@ async def parse_tasks(session: ClientSession) -> Union[int, None]:
     """    
     try:
         logger.info(f"Получение количества задач...")
-        async with session.get("https://kispython.ru/group/0") as page:
+        async with kispython_scheduler.slot(Priority.BACKGROUND) as call, \
+                session.get("https://kispython.ru/group/0") as page:
+            call.check(page.status)
             content = await page.read()
-            parse = BeautifulSoup(content, "html.parser")
-            login_form = parse.find(name="table")
-            if login_form is None:
-                return None
-            tr = login_form.find(name="thead").find("tr")
-            numbers = tr.find_all(name="a")
-            logger.info(f"Всего {len(numbers)} задач")
-            return len(numbers)
+        count = await parse_executor.run(count_tasks, content)
+        if count is not None:
+            logger.info(f"Всего {count} задач")
+        return count
     except ClientConnectionError as E:
         logger.error(f"Не удалось получить кол-во задач")
         return None
+
+
+async def probe_session(session: ClientSession, priority: Priority = Priority.CRITICAL) -> Union[bool, None]:
+    """Проверяет, авторизована ли сессия, одним запросом без перехода по редиректам
+    и без чтения страницы
+
+    :param session: объект сессии
+    :type session: ClientSession
+    :param priority: класс запроса в kispython_scheduler
+    :type priority: Priority
+    :return: True - сессия действительна, False - истекла, None - не удалось проверить
+    :rtype: Union[bool, None]
+    """
+    try:
+        async with kispython_scheduler.slot(priority) as call, \
+                session.get(config.SESSION_PROBE_URL, allow_redirects=False) as page:
+            call.check(page.status)
+            if page.status == 200:
+                return True
+            if page.status in EXPIRED_STATUSES:
+                return False
+            return None
+    except ClientConnectionError as E:
+        logger.error(f"Не удалось проверить сессию, сервер недоступен {E}")
+        return None
+
+
+async def check_session(user_data: UserData, priority: Priority = Priority.CRITICAL) -> Union[bool, None]:
+    """Проверяет сессию пользователя и запоминает время успешной проверки
+
+    :param user_data: данные пользователя
+    :type user_data: UserData
+    :param priority: класс запроса в kispython_scheduler
+    :type priority: Priority
+    :return: True - сессия действительна, False - истекла, None - не удалось проверить
+    :rtype: Union[bool, None]
+    """
+    async with client_pool.user_session(user_data.cookie_jar) as session:
+        valid = await probe_session(session, priority)
+    if valid:
+        user_data.validated = time.monotonic()
+    return valid
+
+
+def expire_session(user_data: UserData):
+    """Отмечает сессию пользователя истёкшей и сбрасывает использованные
+    данные авторизации, чтобы следующий /auth начался с новой сессии
+
+    :param user_data: данные пользователя
+    :type user_data: UserData
+    """
+    user_data.authorized = False
+    user_data.session_data = None
+    user_data.cookie_jar = CookieJar()
+    user_data.csrf_token = None
+    user_data.validated = 0
+
+
+@dataclass(slots=True)
+class PreparedLogin:
+    """
+    Сессия, заранее подготовленная к авторизации через prepare_session_for_login
+    """
+    cookie_jar: CookieJar #: Cookie сессии
+    session_data: dict #: Данные для авторизации (передаётся в login_via_lks)
+    created: float #: Время подготовки, time.monotonic()
+
+
+class LoginPool:
+    """
+    Пул заранее подготовленных к авторизации сессий
+
+    Пул пополняется в фоне до size сессий, сессии старше ttl секунд отбрасываются.
+    При вводе логина и пароля остаётся выполнить только login_via_lks
+
+    :param size: количество подготовленных сессий
+    :type size: int
+    :param ttl: время, в течение которого подготовленная сессия считается свежей, в секундах
+    :type ttl: float
+    """
+    def __init__(self, size: int, ttl: float):
+        self.hits = 0 #: Кол-во авторизаций с заранее подготовленной сессией
+        self.misses = 0 #: Кол-во авторизаций, подготовивших сессию на месте
+        self._size = size
+        self._ttl = ttl
+        self._ready: Deque[PreparedLogin] = deque()
+        self._filling: Union[asyncio.Task, None] = None
+
+    @staticmethod
+    async def prepare(priority: Priority = Priority.CRITICAL) -> Tuple[AuthStatus, Union[PreparedLogin, None]]:
+        """
+        Подготавливает новую сессию к авторизации
+
+        :param priority: класс запроса в kispython_scheduler
+        :type priority: Priority
+
+        :return: Cтатус ответа и подготовленная сессия
+        :rtype: Tuple[AuthStatus, Union[PreparedLogin, None]]
+        """
+        cookie_jar = CookieJar()
+        async with client_pool.user_session(cookie_jar) as session:
+            status, session_data = await prepare_session_for_login(session, priority)
+        if status != AuthStatus.SUCCESS:
+            return status, None
+        return status, PreparedLogin(cookie_jar, session_data, time.monotonic())
+
+    def _drop_stale(self):
+        deadline = time.monotonic() - self._ttl
+        while self._ready and self._ready[0].created < deadline:
+            self._ready.popleft()
+
+    def replenish(self):
+        """
+        Запускает фоновое пополнение пула, если оно ещё не идёт
+        """
+        if self._size > 0 and (self._filling is None or self._filling.done()):
+            self._filling = asyncio.create_task(self._fill())
+
+    async def _fill(self):
+        self._drop_stale()
+        while len(self._ready) < self._size:
+            # Пополнение пула не должно обгонять авторизации и отправки решений
+            status, prepared = await self.prepare(Priority.BACKGROUND)
+            if prepared is None:
+                logger.warning(f"Не удалось подготовить сессию для авторизации: {status.get_message()}")
+                return
+            self._ready.append(prepared)
+
+    async def acquire(self) -> Tuple[AuthStatus, Union[PreparedLogin, None]]:
+        """
+        Возвращает свежую подготовленную сессию, при необходимости готовит её на месте
+
+        :return: Cтатус ответа и подготовленная сессия
+        :rtype: Tuple[AuthStatus, Union[PreparedLogin, None]]
+        """
+        self._drop_stale()
+        if self._ready:
+            self.hits += 1
+            prepared = self._ready.pop()  # самая свежая
+            self.replenish()
+            return AuthStatus.SUCCESS, prepared
+        self.misses += 1
+        self.replenish()
+        return await self.prepare()
+
+    async def close(self):
+        """
+        Останавливает пополнение пула
+        """
+        if self._filling is not None:
+            self._filling.cancel()
+            await asyncio.gather(self._filling, return_exceptions=True)
+            self._filling = None
+        self._ready.clear()
+
+
+class SessionKeeper(PeriodicTask):
+    """
+    Фоновая проверка сессий активных пользователей
+
+    Раз в interval секунд проверяет сессии пользователей, обращавшихся
+    к боту за последние window секунд, не более concurrency одновременно.
+    Запрос продлевает сессию на сервере, а истёкшие сессии отмечаются
+    неавторизованными до начала работы обработчиков. Повторная авторизация
+    без участия пользователя невозможна, так как пароль не сохраняется
+
+    :param db: хранилище данных пользователей
+    :type db: UserStore
+    :param interval: период проверки, в секундах
+    :type interval: float
+    :param window: окно активности пользователя, в секундах
+    :type window: float
+    :param concurrency: количество одновременных проверок
+    :type concurrency: int
+    """
+    immediate = False
+    error_text = "Ошибка фоновой проверки сессий"
+
+    def __init__(self, db: UserStore, interval: float, window: float, concurrency: int = 4):
+        super().__init__(interval)
+        self.probes = 0 #: Кол-во выполненных проверок
+        self.expired = 0 #: Кол-во обнаруженных истёкших сессий
+        self._db = db
+        self._window = window
+        self._concurrency = concurrency
+
+    async def tick(self):
+        await self.refresh()
+
+    async def refresh(self):
+        """
+        Проверяет сессии всех недавно активных авторизованных пользователей
+        """
+        semaphore = asyncio.Semaphore(self._concurrency)
+
+        async def refresh_one(user_id: int, user_data: UserData):
+            async with semaphore:
+                self.probes += 1
+                if await check_session(user_data, Priority.BACKGROUND) is False:
+                    self.expired += 1
+                    expire_session(user_data)
+                    await self._db.set(user_id, user_data)
+
+        await asyncio.gather(*(refresh_one(user_id, user_data)
+                               for user_id, user_data in self._db.recent(self._window) if user_data.authorized))
+
+
+#: Общий пул подготовленных к авторизации сессий
+login_pool = LoginPool(config.LOGIN_POOL_SIZE, config.LOGIN_POOL_TTL)
@@ -1,10 +1,14 @@
-from typing import Callable, Dict, Any, Awaitable
+import time
+from typing import Callable, Dict, Any, Awaitable, Union
 from logging import getLogger
 
 from aiogram import BaseMiddleware
-from aiogram.types import Message
+from aiogram.types import CallbackQuery, Message
 
-from .db import UserData
+from . import config
+from .admission import RateLimiter, wait_text
+from .db import UserData, UserStore
+from .login import check_session, expire_session
 
 
 logger = getLogger(__name__)
@@ -14,18 +18,66 @@ class AuthMiddleware(BaseMiddleware):
     """
     При включении в маршрутизатор гарантирует,
     что команда будет обработана только если пользователь авторизован
+
+    Если сессия не проверялась дольше probe_interval секунд, она проверяется
+    одним лёгким запросом, и при истёкшей сессии обработчик не вызывается
+
+    :param probe_interval: период проверки сессии, в секундах, 0 - не проверять
+    :type probe_interval: float
     """
+    def __init__(self, probe_interval: float = config.SESSION_PROBE_INTERVAL):
+        self._probe_interval = probe_interval
+
     async def __call__(
             self,
             handler: Callable[[Message, Dict[str, UserData], Dict[str, Any]], Awaitable[Any]],
             message: Message,
             data: Dict[str, Any]
     ) -> Any:
-        db: Dict[int, UserData] = data.get("db")
+        db: UserStore = data.get("db")
         assert db is not None, "Забыли передать db в bot.start_pooling в main"
         user_id = message.from_user.id
-        user_data = db.get(user_id)
+        user_data = await db.get(user_id)
         if user_data is None or user_data.authorized is False:
             logger.info("Вызов команды без авторизации")            
             return await message.answer("Для этого авторизуйтесь через /auth")
+        if self._probe_interval and time.monotonic() - user_data.validated > self._probe_interval:
+            if await check_session(user_data) is False:
+                logger.info("Сессия пользователя истекла")
+                expire_session(user_data)
+                await db.set(user_id, user_data)
+                return await message.answer("Сессия ЛКС истекла, авторизуйтесь заново через /auth")
         return await handler(message, data)
+
+
+class AdmissionMiddleware(BaseMiddleware):
+    """
+    Допускает к обработке события в пределах ограничения частоты для пользователя
+
+    Отклонённое событие не ставится в очередь: пользователь сразу получает ответ,
+    через сколько секунд повторить действие. Места в UpstreamGate занимает сам
+    обработчик на время обращений к сервису и, если места нет, возвращает токен
+    через limiter.refund
+
+    :param limiter: ограничение частоты действий пользователя
+    :type limiter: RateLimiter
+    :param when: условие, при котором действие ограничивается, по умолчанию всегда
+    :type when: Callable[[Union[Message, CallbackQuery], Dict[str, Any]], bool]
+    """
+    def __init__(self, limiter: RateLimiter,
+                 when: Callable[[Union[Message, CallbackQuery], Dict[str, Any]], bool] = None):
+        self._limiter = limiter
+        self._when = when
+
+    async def __call__(
+            self,
+            handler: Callable[[Union[Message, CallbackQuery], Dict[str, Any]], Awaitable[Any]],
+            event: Union[Message, CallbackQuery],
+            data: Dict[str, Any]
+    ) -> Any:
+        if self._when is not None and not self._when(event, data):
+            return await handler(event, data)
+        if wait := self._limiter.acquire(event.from_user.id):
+            logger.info(f"Действие отклонено, повтор через {wait:.1f} с")
+            return await event.answer(wait_text(wait))
+        return await handler(event, data)
@@ -0,0 +1,148 @@
+import asyncio
+import heapq
+import itertools
+import time
+from contextlib import asynccontextmanager, nullcontext
+from dataclasses import dataclass
+from enum import IntEnum
+from typing import AsyncIterator, Dict, List, Tuple, Union
+
+from . import config
+from .breaker import BreakerCall, CircuitBreaker, kispython_breaker
+
+
+class Priority(IntEnum):
+    """
+    Класс запроса к kispython, меньшее значение обслуживается раньше
+    """
+    CRITICAL = 0 #: Авторизация и отправка решения
+    CONDITION = 1 #: Загрузка условия по запросу пользователя
+    VERDICT = 2 #: Проверка результата решения
+    BACKGROUND = 3 #: Фоновые запросы: прогрев условий, каталог, продление сессий
+
+
+@dataclass(slots=True)
+class WaitStats:
+    """
+    Статистика ожидания в очереди одного класса запросов
+    """
+    count: int = 0 #: Кол-во допущенных запросов
+    queued: int = 0 #: Кол-во запросов, ожидавших в очереди
+    total_wait: float = 0 #: Суммарное время ожидания, в секундах
+    max_wait: float = 0 #: Максимальное время ожидания, в секундах
+
+
+class OutboundScheduler:
+    """
+    Планировщик исходящих запросов к одному серверу
+
+    Одновременно выполняется не больше limit запросов, остальные ждут в очереди
+    с приоритетами: освободившееся место получает запрос с наименьшим Priority,
+    при равном приоритете - пришедший раньше. Лимит должен быть меньше лимита
+    соединений к хосту в client_pool, иначе очередь образуется в пуле соединений без приоритетов
+
+    Если задан breaker, при разомкнутом предохранителе запрос отклоняется
+    с CircuitOpenError ещё до очереди, а ошибки соединения, таймауты
+    и ответы 5xx (BreakerCall.check) учитываются предохранителем
+
+    :param limit: максимальное количество одновременных запросов
+    :type limit: int
+    :param breaker: предохранитель сервера
+    :type breaker: Union[CircuitBreaker, None]
+    """
+    def __init__(self, limit: int, breaker: Union[CircuitBreaker, None] = None):
+        self._limit = limit
+        self._breaker = breaker
+        self._active = 0
+        self._order = itertools.count()
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._stats: Dict[Priority, WaitStats] = {priority: WaitStats() for priority in Priority}
+
+    async def acquire(self, priority: Priority):
+        """
+        Ожидает свободного места для запроса
+
+        :param priority: класс запроса
+        :type priority: Priority
+        """
+        stats = self._stats[priority]
+        stats.count += 1
+        if self._active < self._limit and not self._waiters:
+            self._active += 1
+            return
+        stats.queued += 1
+        started = time.monotonic()
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._order), future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            # Место уже передано отменённому запросу - передаётся следующему
+            if future.done() and not future.cancelled():
+                self.release()
+            else:
+                future.cancel()
+            raise
+        finally:
+            wait = time.monotonic() - started
+            stats.total_wait += wait
+            stats.max_wait = max(stats.max_wait, wait)
+
+    def release(self):
+        """
+        Освобождает место, передавая его следующему запросу в очереди
+        """
+        while self._waiters:
+            *_, future = heapq.heappop(self._waiters)
+            if not future.done():
+                future.set_result(None)
+                return
+        self._active -= 1
+
+    @asynccontextmanager
+    async def slot(self, priority: Priority,
+                   breaker: Union[CircuitBreaker, None] = None) -> AsyncIterator[BreakerCall]:
+        """
+        Контекстный менеджер, занимающий место на время запроса
+
+        :param priority: класс запроса
+        :type priority: Priority
+        :param breaker: предохранитель другого сервиса, если запрос уходит не только на этот сервер
+        :type breaker: Union[CircuitBreaker, None]
+        :raises CircuitOpenError: предохранитель сервера разомкнут
+        :return: объект запроса, через который сообщается статус ответа
+        :rtype: BreakerCall
+        """
+        breaker = breaker or self._breaker
+        async with breaker.guard() if breaker is not None else nullcontext(BreakerCall()) as call:
+            await self.acquire(priority)
+            try:
+                yield call
+            finally:
+                self.release()
+
+    @property
+    def active(self) -> int:
+        """
+        Количество выполняющихся запросов
+        """
+        return self._active
+
+    def __len__(self):
+        return sum(not future.done() for *_, future in self._waiters)
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        """
+        Возвращает статистику ожидания по классам запросов
+
+        :return: словарь класс -> count, queued, avg_wait, max_wait
+        :rtype: Dict[str, Dict[str, float]]
+        """
+        return {priority.name: {"count": stats.count, "queued": stats.queued,
+                                "avg_wait": stats.total_wait / stats.queued if stats.queued else 0,
+                                "max_wait": stats.max_wait}
+                for priority, stats in self._stats.items()}
+
+
+#: Общий планировщик запросов к kispython
+kispython_scheduler = OutboundScheduler(config.KISPYTHON_CONCURRENCY, kispython_breaker)
@@ -0,0 +1,277 @@
+import asyncio
+import re
+from html import unescape
+from html.parser import HTMLParser
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Tuple, Union
+
+from bs4 import BeautifulSoup, NavigableString, SoupStrainer
+
+from . import config
+
+
+VARIANT_ID = re.compile(r"^вариант-(\d+)$")
+GROUP_HREF = re.compile(r"^/group/(\d+)/?$")
+INPUT_TAG = re.compile(r"<input\b[^>]*>", re.IGNORECASE)
+TAG_ATTR = re.compile(r"""([\w:-]+)\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s"'=<>`]+))""")
+VERDICT_CLASSES = ("badge alert", "text-muted mb-2", "callout callout-success")
+
+
+def to_text(content: Union[str, bytes]) -> str:
+    """Декодирует ответ сервера (страницы kispython и ЛКС в utf-8)
+
+    :param content: Текст страницы
+    :type content: Union[str, bytes]
+    :return: Текст страницы
+    :rtype: str
+    """
+    return content.decode("utf-8", "replace") if isinstance(content, bytes) else content
+
+
+def scan_inputs(content: Union[str, bytes]) -> Dict[str, str]:
+    """Быстро извлекает значения полей <input> без построения дерева документа
+
+    :param content: Текст страницы
+    :type content: Union[str, bytes]
+    :return: Словарь name -> value для первых полей с каждым именем
+    :rtype: Dict[str, str]
+    """
+    inputs = {}
+    for tag in INPUT_TAG.finditer(to_text(content)):
+        attrs = {match[1].lower(): unescape(match[2] or match[3] or match[4] or "")
+                 for match in TAG_ATTR.finditer(tag.group())}
+        if "name" in attrs:
+            inputs.setdefault(attrs["name"], attrs.get("value", ""))
+    return inputs
+
+
+def is_verdict_tag(name: str, attrs: Dict[str, str]) -> bool:
+    # Формы разбираются целиком, чтобы сохранить родителя сообщения
+    if name == "form":
+        return True
+    return name == "div" and any(attrs.get("class", "").startswith(cls) for cls in VERDICT_CLASSES)
+
+
+def split_variants(content: Union[str, bytes]) -> Dict[int, str]:
+    """Разбирает страницу с заданием на html фрагменты отдельных вариантов
+
+    :param content: Текст страницы с заданием
+    :type content: Union[str, bytes]
+    :return: Словарь вариант -> html фрагмент
+    :rtype: Dict[int, str]
+    """
+    parse = BeautifulSoup(content, "html.parser")
+    fragments = {}
+    for tag in parse.find_all(name="h2", id=VARIANT_ID):
+        html = str(tag)
+        next_sibling = tag.next_sibling
+        while next_sibling is not None:
+            # Пропускает NavigableString "\n"
+            if not isinstance(next_sibling, NavigableString):
+                if VARIANT_ID.match(next_sibling.attrs.get('id', '')):
+                    break
+                html += str(next_sibling)
+            next_sibling = next_sibling.next_sibling
+        fragments[int(VARIANT_ID.match(tag["id"]).group(1))] = html
+    return fragments
+
+
+def extract_login_form(content: Union[str, bytes]) -> Union[Dict[str, str], None]:
+    """Извлекает csrfmiddlewaretoken и адрес следующего редиректа со страницы входа
+
+    :param content: Текст страницы входа
+    :type content: Union[str, bytes]
+    :return: Словарь с ключами csrfmiddlewaretoken, next или None
+    :rtype: Union[Dict[str, str], None]
+    """
+    inputs = scan_inputs(content)
+    if "csrfmiddlewaretoken" in inputs and "next" in inputs:
+        return {"csrfmiddlewaretoken": inputs["csrfmiddlewaretoken"], "next": inputs["next"]}
+    parse = BeautifulSoup(content, "html.parser")
+    csrf_tag = parse.find(name="input", attrs={"name": "csrfmiddlewaretoken"})  # CSRF код
+    next_tag = parse.find(name="input", attrs={"name": "next"})  # адрес следующего редиректа
+    if csrf_tag is None or next_tag is None:
+        return None
+    return {"csrfmiddlewaretoken": csrf_tag["value"], "next": next_tag["value"]}
+
+
+def extract_login_error(content: Union[str, bytes]) -> Union[str, None]:
+    """Возвращает текст формы входа ЛКС, если после авторизации она снова показана
+
+    :param content: Текст страницы ответа на авторизацию
+    :type content: Union[str, bytes]
+    :return: Текст формы входа или None, если авторизация прошла
+    :rtype: Union[str, None]
+    """
+    text = to_text(content)
+    if "mirea-users-loginform" not in text:
+        return None
+    parse = BeautifulSoup(text, "html.parser", parse_only=SoupStrainer(id="mirea-users-loginform"))
+    login_form = parse.find(id="mirea-users-loginform")
+    if login_form is None:
+        parse = BeautifulSoup(text, "html.parser")
+        login_form = parse.find(id="mirea-users-loginform")
+    return None if login_form is None else login_form.text
+
+
+def extract_csrf_token(content: Union[str, bytes]) -> Union[str, None]:
+    """Извлекает csrf_token формы отправки решения со страницы задачи
+
+    :param content: Текст страницы задачи
+    :type content: Union[str, bytes]
+    :return: Токен или None
+    :rtype: Union[str, None]
+    """
+    if (token := scan_inputs(content).get("csrf_token")) is not None:
+        return token
+    parse = BeautifulSoup(content, "html.parser")
+    csrf_tag = parse.find(name="input", attrs={"name": "csrf_token"})
+    return None if csrf_tag is None else csrf_tag["value"]
+
+
+def count_tasks(content: Union[str, bytes]) -> Union[int, None]:
+    """Возвращает количество задач в таблице группы
+
+    :param content: Текст страницы группы
+    :type content: Union[str, bytes]
+    :return: Количество задач или None
+    :rtype: Union[int, None]
+    """
+    parse = BeautifulSoup(content, "html.parser", parse_only=SoupStrainer("table"))
+    table = parse.find(name="table")
+    if table is None:
+        return None
+    tr = table.find(name="thead").find("tr")
+    return len(tr.find_all(name="a"))
+
+
+def extract_groups(content: Union[str, bytes]) -> Dict[int, str]:
+    """Возвращает группы из ссылок вида /group/{id} на главной странице
+
+    :param content: Текст главной страницы
+    :type content: Union[str, bytes]
+    :return: Словарь id группы -> название
+    :rtype: Dict[int, str]
+    """
+    parse = BeautifulSoup(content, "html.parser", parse_only=SoupStrainer("a", href=GROUP_HREF))
+    groups = {}
+    for link in parse.find_all("a"):
+        if name := link.text.strip():
+            groups[int(GROUP_HREF.match(link["href"]).group(1))] = name
+    return groups
+
+
+def parse_verdict(content: Union[str, bytes]) -> Union[Tuple[str, Union[str, None]], None]:
+    """
+    Извлекает результат проверки решения со страницы задачи
+
+    :param content: Текст страницы задачи
+    :type content: Union[str, bytes]
+    :return: Статус проверки и сообщение или None, если проверка ещё идёт
+    :rtype: Union[Tuple[str, Union[str, None]], None]
+    """
+    text = to_text(content)
+    if "badge alert" not in text:
+        return None
+    parse = BeautifulSoup(text, "html.parser", parse_only=SoupStrainer(is_verdict_tag))
+    if (status_tag := parse.find(name="div", attrs={"class": re.compile("^badge alert")})) is None:
+        parse = BeautifulSoup(text, "html.parser")
+        status_tag = parse.find(name="div", attrs={"class": re.compile("^badge alert")})
+    if status_tag is None:
+        return None
+    status = status_tag.text.strip()
+    if "Отправлено" in status:
+        return None
+    msg_tag = parse.find(name="div", attrs={"class": "text-muted mb-2"})
+    msg = msg_tag.text
+    if msg_tag.parent.name == "form":
+        msg = parse.find(name="div", attrs={"class": "callout callout-success"})
+        msg = msg.find("div").text + "\n" + msg.find("small").text
+    return status, msg
+
+
+def parse_verdict_page(content: Union[str, bytes]) -> Tuple[Union[Tuple[str, Union[str, None]], None], Union[str, None]]:
+    """
+    Извлекает результат проверки и свежий csrf_token со страницы задачи
+
+    :param content: Текст страницы задачи
+    :type content: Union[str, bytes]
+    :return: Результат parse_verdict и токен или None
+    :rtype: Tuple[Union[Tuple[str, Union[str, None]], None], Union[str, None]]
+    """
+    text = to_text(content)
+    return parse_verdict(text), scan_inputs(text).get("csrf_token")
+
+
+class HeadingWatcher(HTMLParser):
+    """
+    Инкрементальный парсер, отслеживающий появление заголовка <h2> с заданным id
+
+    Используется при потоковой загрузке условий: после появления заголовка
+    следующего варианта дальнейшее чтение страницы не нужно
+
+    :param heading_id: id искомого заголовка
+    :type heading_id: str
+    """
+    def __init__(self, heading_id: str):
+        super().__init__(convert_charrefs=False)
+        self.heading_id = heading_id
+        self.found: Union[str, None] = None #: Исходный текст найденного открывающего тега
+
+    def handle_starttag(self, tag, attrs):
+        if self.found is None and tag == "h2" and dict(attrs).get("id") == self.heading_id:
+            self.found = self.get_starttag_text()
+
+
+class ParseExecutor:
+    """
+    Выполняет разбор html вне цикла событий
+
+    Страницы короче inline_threshold разбираются сразу, остальные - в пуле
+    потоков (thread) или процессов (process). Функции разбора должны быть
+    объявлены на уровне модуля и возвращать простые объекты
+
+    :param kind: тип пула: thread или process
+    :type kind: str
+    :param workers: размер пула
+    :type workers: int
+    :param inline_threshold: размер страницы, до которого разбор идёт в цикле событий
+    :type inline_threshold: int
+    """
+    def __init__(self, kind: str, workers: int, inline_threshold: int):
+        self._kind = kind
+        self._workers = workers
+        self._inline_threshold = inline_threshold
+        self._executor: Union[Executor, None] = None
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            if self._kind == "process":
+                self._executor = ProcessPoolExecutor(max_workers=self._workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self._workers, thread_name_prefix="parse")
+        return self._executor
+
+    async def run(self, func: Callable[[Union[str, bytes]], Any], content: Union[str, bytes]) -> Any:
+        """
+        Выполняет func(content)
+
+        :param func: функция разбора
+        :type func: Callable[[Union[str, bytes]], Any]
+        :param content: Текст страницы
+        :type content: Union[str, bytes]
+        :return: результат функции разбора
+        :rtype: Any
+        """
+        if len(content) < self._inline_threshold:
+            return func(content)
+        return await asyncio.get_running_loop().run_in_executor(self._get_executor(), func, content)
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+#: Общий пул разбора html
+parse_executor = ParseExecutor(config.PARSE_EXECUTOR, config.PARSE_WORKERS, config.PARSE_INLINE_THRESHOLD)
@@ -0,0 +1,57 @@
+import asyncio
+from logging import getLogger
+from typing import Union
+
+
+logger = getLogger(__name__)
+
+
+class PeriodicTask:
+    """
+    Базовый класс фоновой задачи, которая вызывает tick() раз в interval секунд
+
+    Ошибка одного вызова записывается в лог и не останавливает задачу
+
+    :param interval: период вызова, в секундах
+    :type interval: float
+    """
+    #: Вызывать tick() сразу при запуске, а не через interval секунд
+    immediate = True
+    #: Текст сообщения в логе при ошибке tick()
+    error_text = "Ошибка фоновой задачи"
+
+    def __init__(self, interval: float):
+        self._interval = interval
+        self._task: Union[asyncio.Task, None] = None
+
+    async def tick(self):
+        """
+        Выполняет одну итерацию фоновой задачи
+        """
+        raise NotImplementedError
+
+    def start(self):
+        """
+        Запускает фоновую задачу, должен вызываться внутри цикла событий
+        """
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        """
+        Останавливает фоновую задачу
+        """
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        if not self.immediate:
+            await asyncio.sleep(self._interval)
+        while True:
+            try:
+                await self.tick()
+            except Exception as E:
+                logger.error(f"{self.error_text} {E}")
+            await asyncio.sleep(self._interval)
@@ -0,0 +1,84 @@
+import asyncio
+import json
+import threading
+from typing import Any, Dict, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from . import config
+from .db import connect_sqlite
+
+
+def storage_key(key: StorageKey) -> str:
+    """
+    Возвращает строковый ключ записи FSM, учитывающий destiny (нужно aiogram_dialog)
+
+    :param key: ключ aiogram
+    :type key: StorageKey
+    :return: строковый ключ
+    :rtype: str
+    """
+    return ":".join(str(part) for part in (key.bot_id, key.chat_id, key.user_id, key.thread_id,
+                                            key.business_connection_id, key.destiny))
+
+
+class SQLiteStorage(BaseStorage):
+    """
+    Хранилище состояний FSM и данных aiogram_dialog в SQLite,
+    общее для нескольких процессов бота на одной машине
+
+    Запросы выполняются в отдельном потоке, чтобы не блокировать цикл событий
+
+    :param path: путь к файлу базы данных
+    :type path: str
+    """
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self._connection = connect_sqlite(path, "CREATE TABLE IF NOT EXISTS fsm (key TEXT PRIMARY KEY, state TEXT, data TEXT)")
+
+    def _get(self, key: str, column: str) -> Optional[str]:
+        with self._lock:
+            row = self._connection.execute(f"SELECT {column} FROM fsm WHERE key = ?", (key,)).fetchone()
+        return None if row is None else row[0]
+
+    def _set(self, key: str, column: str, value: Optional[str]):
+        with self._lock, self._connection:
+            self._connection.execute(f"INSERT INTO fsm (key, {column}) VALUES (?, ?) "
+                                     f"ON CONFLICT(key) DO UPDATE SET {column} = excluded.{column}", (key, value))
+            self._connection.execute("DELETE FROM fsm WHERE key = ? AND state IS NULL AND data IS NULL", (key,))
+
+    async def set_state(self, key: StorageKey, state: StateType = None):
+        state = state.state if isinstance(state, State) else state
+        await asyncio.to_thread(self._set, storage_key(key), "state", state)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return await asyncio.to_thread(self._get, storage_key(key), "state")
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]):
+        await asyncio.to_thread(self._set, storage_key(key), "data", json.dumps(data) if data else None)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        data = await asyncio.to_thread(self._get, storage_key(key), "data")
+        return {} if data is None else json.loads(data)
+
+    async def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+def create_fsm_storage() -> BaseStorage:
+    """
+    Создаёт хранилище FSM, выбранное в config.FSM_STORAGE
+
+    :return: хранилище memory, redis или sqlite
+    :rtype: BaseStorage
+    """
+    if config.FSM_STORAGE == "redis":
+        # redis - необязательная зависимость, нужна только для этого режима
+        from aiogram.fsm.storage.redis import DefaultKeyBuilder, RedisStorage
+        return RedisStorage.from_url(config.REDIS_URL, key_builder=DefaultKeyBuilder(with_destiny=True))
+    if config.FSM_STORAGE == "sqlite":
+        return SQLiteStorage(config.FSM_STORAGE_PATH)
+    return MemoryStorage()
@@ -0,0 +1,211 @@
+import asyncio
+import heapq
+import itertools
+import time
+from dataclasses import dataclass, field
+from logging import getLogger
+from typing import Callable, List, Tuple, Union
+
+from aiohttp import ClientConnectionError, CookieJar
+
+from . import config
+from .breaker import CircuitOpenError
+from .client import client_pool
+from .outbound import Priority, kispython_scheduler
+from .parsing import parse_executor, parse_verdict_page
+
+
+logger = getLogger(__name__)
+
+#: Результат проверки, если вердикт не был получен
+UNDEFINED_VERDICT = "Произошла непредвиденная ошибка", None
+#: Результат проверки, если kispython недоступен
+UNAVAILABLE_VERDICT = "Сервер недоступен, результат проверки не получен, посмотрите его на kispython.ru позже", None
+
+
+@dataclass(order=True)
+class VerdictJob:
+    """
+    Ожидание результата проверки одного решения
+    """
+    due: float #: Время следующей проверки
+    seq: int #: Порядковый номер, для стабильного порядка в очереди
+    cookie_jar: CookieJar = field(compare=False) #: Cookie пользователя
+    link: str = field(compare=False) #: Ссылка на страницу задачи
+    delay: float = field(compare=False) #: Текущая задержка между проверками
+    deadline: float = field(compare=False) #: Время, после которого ожидание прекращается
+    future: asyncio.Future = field(compare=False) #: Результат для ожидающего обработчика
+    on_token: Union[Callable[[str], None], None] = field(compare=False, default=None) #: Получатель csrf_token
+
+
+class VerdictScheduler:
+    """
+    Общий планировщик проверки результатов отправленных решений
+
+    Все ожидания хранятся в одной очереди по времени следующей проверки.
+    Первая проверка выполняется быстро, далее задержка растёт экспоненциально,
+    одновременно выполняется не больше max_polls запросов.
+    Результат передаётся ожидающему обработчику через asyncio.Future
+
+    :param max_polls: максимальное количество одновременных запросов
+    :type max_polls: int
+    :param first_delay: задержка перед первой проверкой, в секундах
+    :type first_delay: float
+    :param max_delay: максимальная задержка между проверками, в секундах
+    :type max_delay: float
+    :param timeout: максимальное время ожидания результата, в секундах
+    :type timeout: float
+    :param factor: множитель задержки
+    :type factor: float
+    """
+    def __init__(self, max_polls: int, first_delay: float, max_delay: float, timeout: float, factor: float = 2):
+        self.polls = 0 #: Кол-во выполненных запросов
+        self._max_polls = max_polls
+        self._first_delay = first_delay
+        self._max_delay = max_delay
+        self._timeout = timeout
+        self._factor = factor
+        self._queue: List[VerdictJob] = []
+        self._seq = itertools.count()
+        self._wakeup: Union[asyncio.Event, None] = None
+        self._semaphore: Union[asyncio.Semaphore, None] = None
+        self._dispatcher: Union[asyncio.Task, None] = None
+        self._polling = set()
+
+    def start(self):
+        """
+        Запускает цикл планировщика, должен вызываться внутри цикла событий
+        """
+        if self._dispatcher is None:
+            self._wakeup = asyncio.Event()
+            self._semaphore = asyncio.Semaphore(self._max_polls)
+            self._dispatcher = asyncio.create_task(self._dispatch())
+
+    def submit(self, cookie_jar: CookieJar, link: str,
+               on_token: Union[Callable[[str], None], None] = None) -> asyncio.Future:
+        """
+        Ставит решение в очередь на ожидание результата
+
+        :param cookie_jar: cookie авторизованного пользователя
+        :type cookie_jar: CookieJar
+        :param link: Ссылка на страницу задачи
+        :type link: str
+        :param on_token: вызывается со свежим csrf_token, найденным на странице задачи
+        :type on_token: Union[Callable[[str], None], None], опционально
+        :return: Future со статусом проверки и сообщением
+        :rtype: asyncio.Future
+        """
+        self.start()
+        now = time.monotonic()
+        future = asyncio.get_running_loop().create_future()
+        job = VerdictJob(now + self._first_delay, next(self._seq), cookie_jar, link,
+                         self._first_delay, now + self._timeout, future, on_token)
+        self._push(job)
+        return future
+
+    async def wait(self, cookie_jar: CookieJar, link: str,
+                   on_token: Union[Callable[[str], None], None] = None) -> Tuple[str, Union[str, None]]:
+        """
+        Ожидает результат проверки отправленного решения
+
+        :param cookie_jar: cookie авторизованного пользователя
+        :type cookie_jar: CookieJar
+        :param link: Ссылка на страницу задачи
+        :type link: str
+        :param on_token: вызывается со свежим csrf_token, найденным на странице задачи
+        :type on_token: Union[Callable[[str], None], None], опционально
+        :return: Статус проверки и сообщение
+        :rtype: Tuple[str, Union[str, None]]
+        """
+        return await self.submit(cookie_jar, link, on_token)
+
+    def _push(self, job: VerdictJob):
+        heapq.heappush(self._queue, job)
+        self._wakeup.set()
+
+    async def _dispatch(self):
+        while True:
+            if not self._queue:
+                await self._wakeup.wait()
+                self._wakeup.clear()
+                continue
+            delay = self._queue[0].due - time.monotonic()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+                continue
+            job = heapq.heappop(self._queue)
+            if job.future.done():  # Обработчик перестал ждать
+                continue
+            await self._semaphore.acquire()
+            task = asyncio.create_task(self._poll(job))
+            self._polling.add(task)
+            task.add_done_callback(self._polling.discard)
+
+    async def _fetch(self, job: VerdictJob) -> Union[Tuple[str, Union[str, None]], None]:
+        self.polls += 1
+        try:
+            async with kispython_scheduler.slot(Priority.VERDICT) as call, \
+                    client_pool.user_session(job.cookie_jar) as session, session.get(job.link) as page:
+                call.check(page.status)
+                if page.status != 200:
+                    return UNDEFINED_VERDICT
+                content = await page.read()
+        except CircuitOpenError:
+            return UNAVAILABLE_VERDICT
+        except ClientConnectionError as E:
+            logger.error(f"Не удалось получить результат проверки {E}")
+            return None
+        verdict, token = await parse_executor.run(parse_verdict_page, content)
+        if token is not None and job.on_token is not None:
+            job.on_token(token)
+        return verdict
+
+    @staticmethod
+    def _resolve(job: VerdictJob, verdict: Tuple[str, Union[str, None]]):
+        if not job.future.done():
+            job.future.set_result(verdict)
+
+    async def _poll(self, job: VerdictJob):
+        try:
+            verdict = await self._fetch(job)
+        except asyncio.CancelledError:
+            self._resolve(job, UNDEFINED_VERDICT)
+            raise
+        except Exception as E:
+            if not job.future.done():
+                job.future.set_exception(E)
+            return
+        finally:
+            self._semaphore.release()
+
+        if verdict is not None:
+            return self._resolve(job, verdict)
+        job.delay = min(job.delay * self._factor, self._max_delay)
+        job.due = time.monotonic() + job.delay
+        if job.due > job.deadline:
+            return self._resolve(job, UNDEFINED_VERDICT)
+        self._push(job)
+
+    async def close(self):
+        """
+        Останавливает планировщик, ожидающие обработчики получают UNDEFINED_VERDICT
+        """
+        if self._dispatcher is None:
+            return
+        self._dispatcher.cancel()
+        for task in list(self._polling):
+            task.cancel()
+        await asyncio.gather(self._dispatcher, *self._polling, return_exceptions=True)
+        for job in self._queue:
+            self._resolve(job, UNDEFINED_VERDICT)
+        self._queue.clear()
+        self._dispatcher = None
+
+
+#: Общий планировщик проверки решений
+verdict_scheduler = VerdictScheduler(config.VERDICT_MAX_POLLS, config.VERDICT_FIRST_DELAY,
+                                     config.VERDICT_MAX_DELAY, config.VERDICT_TIMEOUT)
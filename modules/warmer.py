@@ -0,0 +1,100 @@
+import asyncio
+from logging import getLogger
+from typing import Callable, List
+
+from aiohttp import ClientConnectionError
+
+from .cache import ConditionPage, condition_cache, condition_flight
+from .client import client_pool
+from .outbound import Priority, kispython_scheduler
+from .parsing import parse_executor, split_variants
+from .periodic import PeriodicTask
+
+
+logger = getLogger(__name__)
+
+
+class ConditionWarmer(PeriodicTask):
+    """
+    Фоновая загрузка страниц с условиями в condition_cache
+
+    Раз в interval секунд обходит все страницы, не более concurrency одновременно.
+    Уже загруженные страницы проверяются условным запросом
+    (If-None-Match / If-Modified-Since), неизменённая страница стоит один ответ 304.
+    Кэш увеличивается до количества страниц, а загрузки идут через condition_flight
+    и объединяются с запросами пользователей
+
+    :param get_urls: функция, возвращающая ссылки на страницы
+    :type get_urls: Callable[[], List[str]]
+    :param concurrency: количество одновременных загрузок
+    :type concurrency: int
+    :param interval: период обхода, в секундах
+    :type interval: float
+    """
+    error_text = "Ошибка фоновой загрузки условий"
+
+    def __init__(self, get_urls: Callable[[], List[str]], concurrency: int, interval: float):
+        super().__init__(interval)
+        self.fetched = 0 #: Кол-во загруженных страниц
+        self.not_modified = 0 #: Кол-во ответов 304
+        self.failed = 0 #: Кол-во неудачных загрузок
+        self._get_urls = get_urls
+        self._concurrency = concurrency
+
+    async def tick(self):
+        await self.warm()
+
+    async def warm(self):
+        """
+        Загружает или проверяет актуальность всех страниц
+        """
+        urls = self._get_urls()
+        # Иначе обход по кругу вытесняет из LRU страницы раньше, чем до них дойдёт очередь
+        if condition_cache.reserve(len(urls)):
+            logger.info(f"Кэш условий увеличен до {condition_cache.maxsize} страниц")
+        semaphore = asyncio.Semaphore(self._concurrency)
+
+        async def revalidate(url: str):
+            async with semaphore:
+                await self.revalidate(url)
+
+        await asyncio.gather(*(revalidate(url) for url in urls))
+        logger.info(f"Условия обновлены: загружено {self.fetched}, без изменений {self.not_modified}, "
+                    f"ошибок {self.failed}")
+
+    async def revalidate(self, url: str):
+        """
+        Загружает страницу или подтверждает актуальность сохранённой
+
+        :param url: ссылка на страницу без якоря
+        :type url: str
+        """
+        try:
+            await condition_flight.do(url, lambda: self._revalidate(url))
+        except (AssertionError, ClientConnectionError) as E:
+            self.failed += 1
+            logger.error(f"Не удалось загрузить условие {url} {E}")
+
+    async def _revalidate(self, url: str) -> ConditionPage:
+        cached = condition_cache.peek(url)
+        headers = {}
+        if cached is not None and cached.complete:
+            if cached.etag is not None:
+                headers["If-None-Match"] = cached.etag
+            if cached.last_modified is not None:
+                headers["If-Modified-Since"] = cached.last_modified
+        async with kispython_scheduler.slot(Priority.BACKGROUND) as call, \
+                client_pool.session.get(url, headers=headers) as page:
+            call.check(page.status)
+            if page.status == 304 and headers:
+                self.not_modified += 1
+                condition_cache.set(url, cached)
+                return cached
+            assert page.status == 200, f"статус {page.status}"
+            content = await page.text('utf-8')
+            etag, last_modified = page.headers.get("ETag"), page.headers.get("Last-Modified")
+        fragments = await parse_executor.run(split_variants, content)
+        page = ConditionPage(fragments, True, etag, last_modified)
+        condition_cache.set(url, page)
+        self.fetched += 1
+        return page
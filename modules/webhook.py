@@ -0,0 +1,173 @@
+import asyncio
+from logging import getLogger
+from typing import Any, Dict, List, Sequence, Union
+
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import ClientError, web
+
+from . import config
+from .client import client_pool
+
+
+logger = getLogger(__name__)
+
+#: Заголовок обновления, пересланного другим процессом бота
+FORWARDED_HEADER = "X-Bot-Worker-Forwarded"
+
+
+def update_user_id(update: Dict[str, Any]) -> Union[int, None]:
+    """
+    Возвращает id пользователя (или чата), от которого пришло обновление,
+    без разбора обновления в модели aiogram
+
+    :param update: обновление в формате Bot API
+    :type update: Dict[str, Any]
+    :return: id пользователя или None
+    :rtype: Union[int, None]
+    """
+    for value in update.values():
+        if isinstance(value, dict):
+            user = value.get("from") or value.get("user") or value.get("chat")
+            if isinstance(user, dict) and "id" in user:
+                return user["id"]
+    return None
+
+
+def worker_urls() -> List[str]:
+    """
+    Возвращает адреса всех процессов бота из config.WORKER_URLS
+
+    :return: список адресов, пустой - процесс работает один
+    :rtype: List[str]
+    """
+    return [url.strip().rstrip("/") for url in config.WORKER_URLS.split(",") if url.strip()]
+
+
+class BoundedRequestHandler(SimpleRequestHandler):
+    """
+    Обработчик webhook, который отвечает Telegram сразу, а обновления
+    обрабатывает в фоне, не больше concurrency одновременно
+
+    Когда все места заняты, ответ на запрос задерживается до освобождения места,
+    и Telegram не присылает новые обновления сверх max_connections
+
+    Если задан список процессов workers, пользователи распределяются между ними
+    по user_id % len(workers), а обновления чужих пользователей пересылаются
+    своему процессу. Так состояние и кэш пользователя живут в одном процессе
+
+    :param dispatcher: диспетчер aiogram
+    :type dispatcher: Dispatcher
+    :param bot: объект бота
+    :type bot: Bot
+    :param concurrency: максимальное количество одновременно обрабатываемых обновлений
+    :type concurrency: int
+    :param workers: адреса всех процессов бота, включая этот
+    :type workers: Sequence[str]
+    :param worker_id: номер этого процесса в workers
+    :type worker_id: int
+    """
+    def __init__(self, dispatcher: Dispatcher, bot: Bot, concurrency: int,
+                 workers: Sequence[str] = (), worker_id: int = 0, **kwargs: Any):
+        super().__init__(dispatcher, bot, handle_in_background=True, **kwargs)
+        self.handled = 0 #: Кол-во принятых обновлений
+        self.forwarded = 0 #: Кол-во обновлений, пересланных другим процессам
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._workers = list(workers)
+        self._worker_id = worker_id
+
+    def owner(self, update: Dict[str, Any]) -> int:
+        """
+        Возвращает номер процесса, обслуживающего автора обновления
+
+        :param update: обновление в формате Bot API
+        :type update: Dict[str, Any]
+        :return: номер процесса в workers
+        :rtype: int
+        """
+        user_id = update_user_id(update)
+        if not self._workers or user_id is None:
+            return self._worker_id
+        return user_id % len(self._workers)
+
+    async def _forward(self, worker: int, update: Dict[str, Any], bot: Bot) -> web.Response:
+        headers = {FORWARDED_HEADER: str(self._worker_id)}
+        if self.secret_token:
+            headers["X-Telegram-Bot-Api-Secret-Token"] = self.secret_token
+        try:
+            async with client_pool.session.post(self._workers[worker] + config.WEBHOOK_PATH,
+                                                data=bot.session.json_dumps(update),
+                                                headers={**headers, "Content-Type": "application/json"}) as response:
+                await response.read()
+                status = response.status
+        except (ClientError, asyncio.TimeoutError) as E:
+            logger.error(f"Не удалось переслать обновление процессу {worker} {E}")
+            # Telegram повторит доставку обновления
+            return web.Response(status=503)
+        self.forwarded += 1
+        return web.json_response({}, status=status, dumps=bot.session.json_dumps)
+
+    async def _background_feed_update(self, bot: Bot, update: Dict[str, Any]):
+        try:
+            await super()._background_feed_update(bot, update)
+        finally:
+            self._semaphore.release()
+
+    async def _handle_request_background(self, bot: Bot, request: web.Request) -> web.Response:
+        update = await request.json(loads=bot.session.json_loads)
+        if FORWARDED_HEADER not in request.headers and (worker := self.owner(update)) != self._worker_id:
+            return await self._forward(worker, update, bot)
+        await self._semaphore.acquire()
+        task = asyncio.create_task(self._background_feed_update(bot, update))
+        self._background_feed_update_tasks.add(task)
+        task.add_done_callback(self._background_feed_update_tasks.discard)
+        self.handled += 1
+        return web.json_response({}, dumps=bot.session.json_dumps)
+
+    @property
+    def in_flight(self) -> int:
+        """
+        Количество обновлений, обрабатываемых в данный момент
+        """
+        return len(self._background_feed_update_tasks)
+
+    async def close(self):
+        """
+        Дожидается обработки принятых обновлений и закрывает сессию бота
+        """
+        if self._background_feed_update_tasks:
+            logger.info(f"Ожидание обработки обновлений: {self.in_flight}")
+            await asyncio.gather(*self._background_feed_update_tasks, return_exceptions=True)
+        await super().close()
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot, **data: Any):
+    """
+    Принимает обновления через webhook на aiohttp сервере до отмены задачи,
+    data передаётся в обработчики так же, как в dp.start_polling
+
+    :param dp: диспетчер aiogram
+    :type dp: Dispatcher
+    :param bot: объект бота
+    :type bot: Bot
+    """
+    app = web.Application()
+    handler = BoundedRequestHandler(dp, bot, config.WEBHOOK_CONCURRENCY, worker_urls(), config.WORKER_ID,
+                                    secret_token=config.WEBHOOK_SECRET or None, **data)
+    handler.register(app, path=config.WEBHOOK_PATH)
+    setup_application(app, dp, bot=bot, **data)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, config.WEBHOOK_HOST, config.WEBHOOK_PORT).start()
+        logger.info(f"Webhook сервер запущен на {config.WEBHOOK_HOST}:{config.WEBHOOK_PORT}{config.WEBHOOK_PATH}")
+        # При нескольких процессах webhook регистрирует только первый
+        if config.WEBHOOK_URL and config.WORKER_ID == 0:
+            await bot.set_webhook(config.WEBHOOK_URL + config.WEBHOOK_PATH,
+                                  secret_token=config.WEBHOOK_SECRET or None,
+                                  max_connections=config.WEBHOOK_MAX_CONNECTIONS,
+                                  allowed_updates=dp.resolve_used_update_types())
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
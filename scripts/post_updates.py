@@ -0,0 +1,81 @@
+"""
+Отправляет синтетические обновления Telegram на webhook бота и измеряет время ответа
+
+Запуск: ``python scripts/post_updates.py --url http://127.0.0.1:8080/webhook --count 1000``
+
+Бот для проверки можно запустить с BOT_MODE=webhook без WEBHOOK_URL,
+тогда webhook в Telegram не регистрируется. Ответы бота в Telegram при этом
+не доходят, поэтому измеряется только приём и разбор обновлений
+"""
+import argparse
+import asyncio
+import itertools
+import time
+
+from aiohttp import ClientSession
+
+
+update_ids = itertools.count(1)
+
+
+def make_update(user_id: int, text: str) -> dict:
+    """
+    Формирует обновление с текстовым сообщением от пользователя
+
+    :param user_id: id пользователя и чата
+    :type user_id: int
+    :param text: текст сообщения
+    :type text: str
+    :return: обновление в формате Bot API
+    :rtype: dict
+    """
+    update_id = next(update_ids)
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private", "first_name": "Test"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "Test"},
+            "text": text,
+        },
+    }
+
+
+async def post_updates(url: str, count: int, users: int, concurrency: int, text: str, secret: str):
+    semaphore = asyncio.Semaphore(concurrency)
+    headers = {"X-Telegram-Bot-Api-Secret-Token": secret} if secret else {}
+    latencies = []
+    errors = 0
+
+    async def post(session: ClientSession, number: int):
+        nonlocal errors
+        async with semaphore:
+            started = time.perf_counter()
+            async with session.post(url, json=make_update(100000 + number % users, text), headers=headers) as response:
+                await response.read()
+                if response.status != 200:
+                    errors += 1
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    async with ClientSession() as session:
+        await asyncio.gather(*(post(session, number) for number in range(count)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    print(f"Обновлений: {count}, ошибок: {errors}, за {elapsed:.2f} с ({count / elapsed:.0f} в секунду)")
+    print(f"Время ответа: p50 {latencies[len(latencies) // 2] * 1000:.1f} мс, "
+          f"p99 {latencies[int(len(latencies) * 0.99)] * 1000:.1f} мс")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--url", default="http://127.0.0.1:8080/webhook")
+    parser.add_argument("--count", type=int, default=1000, help="количество обновлений")
+    parser.add_argument("--users", type=int, default=100, help="количество разных пользователей")
+    parser.add_argument("--concurrency", type=int, default=40, help="одновременных запросов, как max_connections")
+    parser.add_argument("--text", default="/code", help="текст сообщений")
+    parser.add_argument("--secret", default="", help="WEBHOOK_SECRET бота")
+    args = parser.parse_args()
+    asyncio.run(post_updates(args.url, args.count, args.users, args.concurrency, args.text, args.secret))